@@ -0,0 +1,199 @@
+// backend/analytics.js
+// Streaming per-device statistics and alert rules over the LiveStore.
+//
+// Every reading updates the device's EWMA, rolling mean/min/max over the ring
+// window, z-score and rate of change in O(1) (min/max via monotonic deques).
+// Alert rules are then evaluated once per tick as column-wise passes over the
+// typed arrays for all devices, rather than per-device if/else chains.
+
+const { KIND_HEART, KIND_TEMPERATURE } = require("./liveStore");
+
+const LEVELS = ["green", "yellow", "red"];
+const KINDS = { heart: KIND_HEART, temperature: KIND_TEMPERATURE };
+const METRICS = ["value", "ewma", "mean", "min", "max", "z", "rate"];
+
+// Yellow thresholds match the ones the dashboard summaries always used.
+const DEFAULT_RULES = [
+  { kind: "heart", metric: "ewma", op: ">", value: 100, level: "yellow" },
+  { kind: "heart", metric: "ewma", op: ">", value: 120, level: "red" },
+  { kind: "heart", metric: "ewma", op: "<", value: 50, level: "red" },
+  { kind: "temperature", metric: "ewma", op: ">", value: 99, level: "yellow" },
+  { kind: "temperature", metric: "ewma", op: ">=", value: 100.4, level: "red" },
+  { kind: "temperature", metric: "ewma", op: "<", value: 95, level: "red" },
+  { kind: "any", metric: "z", op: "abs>", value: 3, level: "yellow" },
+];
+
+function compileRule(rule) {
+  if (!METRICS.includes(rule.metric)) throw new Error(`unknown alert metric: ${rule.metric}`);
+  if (![">", ">=", "<", "<=", "abs>"].includes(rule.op)) throw new Error(`unknown alert op: ${rule.op}`);
+  const level = LEVELS.indexOf(rule.level);
+  if (level < 1) throw new Error(`unknown alert level: ${rule.level}`);
+  const kind = rule.kind === "any" || rule.kind === undefined ? -1 : KINDS[rule.kind];
+  if (kind === undefined) throw new Error(`unknown device kind: ${rule.kind}`);
+  return { metric: rule.metric, op: rule.op, value: Number(rule.value), level, kind };
+}
+
+const round2 = (x) => Math.round(x * 100) / 100;
+
+class AnalyticsEngine {
+  constructor(store, { rules = DEFAULT_RULES, alpha = 0.2 } = {}) {
+    this.store = store;
+    this.alpha = alpha;
+    this.rules = rules.map(compileRule);
+    this.known = 0; // devices whose kind has been copied into this.kinds
+    this._allocate(store.slots);
+    store.analytics = this;
+  }
+
+  _allocate(slots) {
+    const cap = this.store.capacity;
+    const grow = (Type, old, width = 1) => {
+      const next = new Type(slots * width);
+      if (old) next.set(old);
+      return next;
+    };
+    this.seq = grow(Float64Array, this.seq); // readings seen per device
+    this.value = grow(Float64Array, this.value);
+    this.ewma = grow(Float64Array, this.ewma);
+    this.sum = grow(Float64Array, this.sum);
+    this.sumSq = grow(Float64Array, this.sumSq);
+    this.mean = grow(Float64Array, this.mean);
+    this.min = grow(Float64Array, this.min);
+    this.max = grow(Float64Array, this.max);
+    this.z = grow(Float64Array, this.z);
+    this.rate = grow(Float64Array, this.rate);
+    this.kinds = grow(Int8Array, this.kinds);
+    this.level = grow(Uint8Array, this.level);
+    // monotonic deques of reading sequence numbers, one ring of `cap` per slot
+    this.minQ = grow(Float64Array, this.minQ, cap);
+    this.maxQ = grow(Float64Array, this.maxQ, cap);
+    this.minHead = grow(Uint32Array, this.minHead);
+    this.minLen = grow(Uint32Array, this.minLen);
+    this.maxHead = grow(Uint32Array, this.maxHead);
+    this.maxLen = grow(Uint32Array, this.maxLen);
+  }
+
+  // Called by LiveStore.push before the value is written to the ring.
+  update(slot, time, value) {
+    const store = this.store;
+    const cap = store.capacity;
+    const base = slot * cap;
+    const count = store.counts[slot];
+    const head = store.heads[slot];
+    const s = this.seq[slot];
+
+    // rolling sum / sum of squares over the window
+    if (count === cap) {
+      const evicted = store.values[base + head];
+      this.sum[slot] -= evicted;
+      this.sumSq[slot] -= evicted * evicted;
+    }
+    this.sum[slot] += value;
+    this.sumSq[slot] += value * value;
+    const n = Math.min(count + 1, cap);
+    const mean = this.sum[slot] / n;
+    const std = Math.sqrt(Math.max(0, this.sumSq[slot] / n - mean * mean));
+    this.mean[slot] = mean;
+    this.z[slot] = std > 1e-9 ? (value - mean) / std : 0;
+
+    if (count > 0) {
+      const prevIdx = base + (head === 0 ? cap - 1 : head - 1);
+      const dt = time - store.times[prevIdx];
+      this.rate[slot] = dt > 0 ? (value - store.values[prevIdx]) / dt : 0;
+      this.ewma[slot] += this.alpha * (value - this.ewma[slot]);
+    } else {
+      this.rate[slot] = 0;
+      this.ewma[slot] = value;
+    }
+    this.value[slot] = value;
+
+    this.min[slot] = this._pushDeque(this.minQ, this.minHead, this.minLen, slot, s, value, false);
+    this.max[slot] = this._pushDeque(this.maxQ, this.maxHead, this.maxLen, slot, s, value, true);
+    this.seq[slot] = s + 1;
+  }
+
+  // Add reading `s` to a monotonic deque and return the window min (or max).
+  // Back entries that can never be the extreme again are popped first.
+  _pushDeque(q, heads, lens, slot, s, value, isMax) {
+    const store = this.store;
+    const cap = store.capacity;
+    const base = slot * cap;
+    let head = heads[slot];
+    let len = lens[slot];
+
+    // drop readings that fall out of the window once `s` is written
+    while (len > 0 && q[base + head] <= s - cap) {
+      head = head + 1 === cap ? 0 : head + 1;
+      len -= 1;
+    }
+    while (len > 0) {
+      const back = q[base + ((head + len - 1) % cap)];
+      const v = store.values[base + (back % cap)];
+      if (isMax ? v > value : v < value) break;
+      len -= 1;
+    }
+    q[base + ((head + len) % cap)] = s;
+    len += 1;
+
+    heads[slot] = head;
+    lens[slot] = len;
+    const front = q[base + head];
+    return front === s ? value : store.values[base + (front % cap)];
+  }
+
+  // Evaluate every rule for every device; returns the previous levels so callers
+  // can tell which devices changed.
+  evaluate() {
+    const devices = this.store.devices;
+    const n = devices.length;
+    for (; this.known < n; this.known++) this.kinds[this.known] = devices[this.known].kind;
+
+    const previous = this.level.slice(0, n);
+    const level = this.level;
+    const kinds = this.kinds;
+    const counts = this.store.counts;
+    level.fill(0, 0, n);
+
+    for (const rule of this.rules) {
+      const col = this[rule.metric];
+      const { kind, value: t, level: l } = rule;
+      switch (rule.op) {
+        case ">": for (let i = 0; i < n; i++) if (col[i] > t && (kind < 0 || kinds[i] === kind) && level[i] < l) level[i] = l; break;
+        case ">=": for (let i = 0; i < n; i++) if (col[i] >= t && (kind < 0 || kinds[i] === kind) && level[i] < l) level[i] = l; break;
+        case "<": for (let i = 0; i < n; i++) if (col[i] < t && (kind < 0 || kinds[i] === kind) && level[i] < l) level[i] = l; break;
+        case "<=": for (let i = 0; i < n; i++) if (col[i] <= t && (kind < 0 || kinds[i] === kind) && level[i] < l) level[i] = l; break;
+        case "abs>": for (let i = 0; i < n; i++) if (Math.abs(col[i]) > t && (kind < 0 || kinds[i] === kind) && level[i] < l) level[i] = l; break;
+      }
+    }
+    for (let i = 0; i < n; i++) if (counts[i] === 0) level[i] = 0; // no readings yet
+    return previous;
+  }
+
+  alertLevel(slot) {
+    return LEVELS[this.level[slot]];
+  }
+
+  stats(slot) {
+    if (this.store.counts[slot] === 0) return null;
+    return {
+      ewma: round2(this.ewma[slot]),
+      mean: round2(this.mean[slot]),
+      min: this.min[slot],
+      max: this.max[slot],
+      z: round2(this.z[slot]),
+      rate: round2(this.rate[slot]),
+    };
+  }
+
+  // Extra fields appended to a device's JSON by LiveStore.deviceJSON.
+  deviceFieldsJSON(slot) {
+    return ',"alertLevel":"' + LEVELS[this.level[slot]] + '","stats":' + JSON.stringify(this.stats(slot));
+  }
+}
+
+// ALERT_RULES may hold a JSON array of rules to replace the defaults.
+function rulesFromEnv(value) {
+  return value ? JSON.parse(value) : DEFAULT_RULES;
+}
+
+module.exports = { AnalyticsEngine, DEFAULT_RULES, LEVELS, rulesFromEnv };
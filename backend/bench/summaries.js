@@ -0,0 +1,85 @@
+// backend/bench/summaries.js
+// Latency of GET /api/summaries at 10, 1k and 10k patients: full responses,
+// conditional (If-None-Match) 304s, and the periodic cache refresh.
+//   node bench/summaries.js [requests]
+
+const http = require("http");
+const express = require("express");
+const { LiveStore } = require("../liveStore");
+const { SummaryCache } = require("../summaries");
+
+const REQUESTS = Number(process.argv[2] || 500);
+
+function buildStore(patients) {
+  const store = new LiveStore({ capacity: 30, initialSlots: patients * 2 });
+  for (let i = 1; i <= patients; i++) {
+    const p = store.addPatient(i, `Patient ${i}`);
+    const hr = store.addDevice(p, 2 * i - 1, "Heart Rate Sensor");
+    const temp = store.addDevice(p, 2 * i, "Temperature Sensor");
+    for (let t = 0; t < 30; t++) {
+      store.push(hr, t, 60 + Math.random() * 50);
+      store.push(temp, t, 97 + Math.random() * 3);
+    }
+  }
+  return store;
+}
+
+function get(agent, port, headers) {
+  return new Promise((resolve, reject) => {
+    const started = process.hrtime.bigint();
+    http.get({ port, path: "/api/summaries", agent, headers }, (res) => {
+      res.resume();
+      res.on("end", () => resolve({ ms: Number(process.hrtime.bigint() - started) / 1e6, res }));
+    }).on("error", reject);
+  });
+}
+
+const pct = (sorted, p) => sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))];
+const fmt = (samples) => {
+  const s = samples.slice().sort((a, b) => a - b);
+  return `p50 ${pct(s, 0.5).toFixed(3)} ms  p99 ${pct(s, 0.99).toFixed(3)} ms`;
+};
+
+async function run(patients) {
+  const store = buildStore(patients);
+  const cache = new SummaryCache(store);
+
+  const refresh = [];
+  for (let i = 0; i < 20; i++) {
+    cache.latest.clear(); // force a full rebuild
+    const started = process.hrtime.bigint();
+    cache.refresh();
+    refresh.push(Number(process.hrtime.bigint() - started) / 1e6);
+  }
+
+  const app = express();
+  app.get("/api/summaries", (req, res) => cache.handle(req, res));
+  const server = app.listen(0);
+  const { port } = server.address();
+  const agent = new http.Agent({ keepAlive: true, maxSockets: 1 });
+
+  const full = [], notModified = [];
+  let bytes = 0;
+  for (let i = 0; i < REQUESTS; i++) {
+    const { ms, res } = await get(agent, port, {});
+    full.push(ms);
+    bytes = Number(res.headers["content-length"] || 0);
+  }
+  for (let i = 0; i < REQUESTS; i++) {
+    const { ms, res } = await get(agent, port, { "If-None-Match": cache.etag });
+    if (res.statusCode !== 304) throw new Error(`expected 304, got ${res.statusCode}`);
+    notModified.push(ms);
+  }
+
+  agent.destroy();
+  server.close();
+
+  console.log(`${String(patients).padStart(6)} patients  (${(bytes / 1024).toFixed(1)} KiB body)`);
+  console.log(`  200 full         ${fmt(full)}`);
+  console.log(`  304 not modified ${fmt(notModified)}`);
+  console.log(`  cache refresh    ${fmt(refresh)}`);
+}
+
+(async () => {
+  for (const n of [10, 1_000, 10_000]) await run(n);
+})();
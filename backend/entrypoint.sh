@@ -31,4 +31,4 @@ fi
 
 # start the server
 echo "Starting server..."
-node server.js
+exec node server.js
@@ -0,0 +1,194 @@
+// backend/fanout.js
+// WebSocket fan-out for /ws/patients.
+//
+// Two client modes:
+//   legacy (default)  - the full patients array every tick, as before
+//   ?mode=delta       - a snapshot on connect, then per-device deltas
+//                       ({ type: "delta", devices: [{ id, patientId, points, battery }] })
+// Delta clients may subscribe to a subset of patients with ?patients=1,2 or by
+// sending { "type": "subscribe", "patients": [1, 2] } (null for all).
+//
+// Every frame is serialized once per distinct subscription, not once per client.
+// Clients whose socket buffer backs up are skipped instead of stalling the tick;
+// once they catch up they get a fresh snapshot in place of the deltas they missed.
+
+const { registry } = require("./metrics");
+
+const serializeSeconds = registry.histogram("iot_ws_serialize_seconds", "Serializing one WebSocket frame (labels: frame)");
+const fanoutSeconds = registry.histogram("iot_ws_fanout_seconds", "Serializing and sending one tick to all clients (labels: mode)");
+
+const MAX_BUFFERED_BYTES = 1 << 20; // skip frames above this
+const DROP_BUFFERED_BYTES = 16 << 20; // give up on the client above this
+
+function parseSubscription(value) {
+  if (value === null || value === undefined || value === "" || value === "*") return null;
+  const ids = (Array.isArray(value) ? value : String(value).split(","))
+    .map((v) => Number(v))
+    .filter((v) => Number.isInteger(v));
+  return new Set(ids);
+}
+
+function subscriptionKey(patients) {
+  return patients ? [...patients].sort((a, b) => a - b).join(",") : "*";
+}
+
+class Fanout {
+  // getSnapshot(patientIdSet | null) returns the patients array, already serialized to JSON
+  constructor(getSnapshot, { maxBufferedBytes = MAX_BUFFERED_BYTES, dropBufferedBytes = DROP_BUFFERED_BYTES } = {}) {
+    this.getSnapshot = getSnapshot;
+    this.maxBufferedBytes = maxBufferedBytes;
+    this.dropBufferedBytes = dropBufferedBytes;
+    this.clients = new Map(); // ws -> { mode, patients, key, stale }
+    this.seq = 0;
+    this.counters = { framesSent: 0, framesSkipped: 0, snapshots: 0, clientsDropped: 0, serializations: 0 };
+
+    const c = this.counters;
+    registry.gauge("iot_ws_clients", "Connected /ws/patients clients", { collect: () => this.clients.size });
+    registry.counter("iot_ws_frames_sent_total", "WebSocket frames sent", { collect: () => c.framesSent });
+    registry.counter("iot_ws_frames_skipped_total", "Frames skipped for clients with a full send buffer", { collect: () => c.framesSkipped });
+    registry.counter("iot_ws_clients_dropped_total", "Clients closed for falling too far behind", { collect: () => c.clientsDropped });
+  }
+
+  add(ws, req) {
+    const url = new URL(req.url, "http://localhost");
+    const patients = parseSubscription(url.searchParams.get("patients"));
+    const client = {
+      mode: url.searchParams.get("mode") === "delta" ? "delta" : "legacy",
+      patients,
+      key: subscriptionKey(patients),
+      stale: false,
+    };
+    this.clients.set(ws, client);
+
+    ws.on("message", (data) => this._onMessage(ws, client, data));
+    ws.on("close", () => this.clients.delete(ws));
+
+    if (client.mode === "delta") this._sendSnapshot(ws, client, new Map());
+  }
+
+  hasLegacyClients() {
+    for (const client of this.clients.values()) if (client.mode === "legacy") return true;
+    return false;
+  }
+
+  // Full patients array for legacy clients, serialized once.
+  broadcastFull() {
+    const started = process.hrtime.bigint();
+    let payload = null;
+    for (const [ws, client] of this.clients) {
+      if (client.mode !== "legacy" || !this._writable(ws)) continue;
+      if (payload === null) {
+        const serializeStarted = process.hrtime.bigint();
+        this.counters.serializations += 1;
+        payload = this.getSnapshot(null);
+        serializeSeconds.observeSince(serializeStarted, { frame: "full" });
+      }
+      ws.send(payload);
+      this.counters.framesSent += 1;
+    }
+    fanoutSeconds.observeSince(started, { mode: "legacy" });
+  }
+
+  // Per-device changes for this tick: [{ id, patientId, points: [{ time, value }], battery }]
+  publishDelta(changes) {
+    if (changes.length === 0) return;
+    const started = process.hrtime.bigint();
+    this.seq += 1;
+
+    const deltas = new Map(); // subscription key -> serialized frame
+    const snapshots = new Map();
+    for (const [ws, client] of this.clients) {
+      if (client.mode !== "delta" || !this._writable(ws)) {
+        if (client.mode === "delta") client.stale = true;
+        continue;
+      }
+      if (client.stale) {
+        this._sendSnapshot(ws, client, snapshots);
+        continue;
+      }
+
+      let frame = deltas.get(client.key);
+      if (frame === undefined) {
+        const devices = client.patients ? changes.filter((c) => client.patients.has(c.patientId)) : changes;
+        frame = devices.length ? this._serialize({ type: "delta", seq: this.seq, devices }) : null;
+        deltas.set(client.key, frame);
+      }
+      if (frame === null) continue;
+      ws.send(frame);
+      this.counters.framesSent += 1;
+    }
+    fanoutSeconds.observeSince(started, { mode: "delta" });
+  }
+
+  // The underlying state was replaced; delta clients get a snapshot on the next publish.
+  invalidate() {
+    for (const client of this.clients.values()) if (client.mode === "delta") client.stale = true;
+  }
+
+  stats() {
+    let legacy = 0, stale = 0;
+    for (const client of this.clients.values()) {
+      if (client.mode === "legacy") legacy += 1;
+      if (client.stale) stale += 1;
+    }
+    return { clients: this.clients.size, legacyClients: legacy, staleClients: stale, seq: this.seq, ...this.counters };
+  }
+
+  _onMessage(ws, client, data) {
+    let msg;
+    try {
+      msg = JSON.parse(data);
+    } catch {
+      return;
+    }
+    if (!msg || msg.type !== "subscribe") return;
+
+    client.patients = parseSubscription(msg.patients);
+    client.key = subscriptionKey(client.patients);
+    client.mode = "delta";
+    this._sendSnapshot(ws, client, new Map());
+  }
+
+  _sendSnapshot(ws, client, cache) {
+    let frame = cache.get(client.key);
+    if (frame === undefined) {
+      const started = process.hrtime.bigint();
+      this.counters.serializations += 1;
+      frame = '{"type":"snapshot","seq":' + this.seq + ',"patients":' + this.getSnapshot(client.patients) + "}";
+      serializeSeconds.observeSince(started, { frame: "snapshot" });
+      cache.set(client.key, frame);
+    }
+    if (ws.readyState !== ws.OPEN) return;
+    ws.send(frame);
+    client.stale = false;
+    this.counters.framesSent += 1;
+    this.counters.snapshots += 1;
+  }
+
+  // False (and counts the skip) when the client cannot take another frame right now.
+  _writable(ws) {
+    if (ws.readyState !== ws.OPEN) return false;
+    if (ws.bufferedAmount > this.dropBufferedBytes) {
+      console.warn("WS client too slow, closing");
+      this.counters.clientsDropped += 1;
+      this.clients.delete(ws);
+      ws.terminate();
+      return false;
+    }
+    if (ws.bufferedAmount > this.maxBufferedBytes) {
+      this.counters.framesSkipped += 1;
+      return false;
+    }
+    return true;
+  }
+
+  _serialize(value) {
+    const started = process.hrtime.bigint();
+    this.counters.serializations += 1;
+    const frame = JSON.stringify(value);
+    serializeSeconds.observeSince(started, { frame: "delta" });
+    return frame;
+  }
+}
+
+module.exports = { Fanout };
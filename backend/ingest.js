@@ -0,0 +1,77 @@
+// backend/ingest.js
+// Decoding for device ingestion batches (POST /api/ingest, /ws/ingest).
+//
+// Binary format (application/octet-stream / binary WS frames): a sequence of
+// fixed-width little-endian records, 24 bytes each:
+//   offset 0  uint32   deviceId
+//   offset 4  float32  battery (NaN = not reported)
+//   offset 8  float64  timestamp, epoch seconds
+//   offset 16 float64  value
+//
+// JSON format: [{ deviceId, timestamp, value, battery? }, ...] or { readings: [...] }
+// (device_id is accepted for deviceId).
+//
+// Both decode into one columnar batch { n, deviceIds, times, values, batteries }
+// so validation and application run over typed arrays, not per-record objects.
+// Fields that are missing or of the wrong type decode to values Producer.ingest
+// rejects: device id 0 (ids start at 1) and NaN.
+
+const RECORD_BYTES = 24;
+
+function allocBatch(n) {
+  return {
+    n,
+    deviceIds: new Uint32Array(n),
+    times: new Float64Array(n),
+    values: new Float64Array(n),
+    batteries: new Float32Array(n),
+  };
+}
+
+function decodeBinary(buf) {
+  if (buf.length % RECORD_BYTES !== 0) {
+    throw new Error(`binary batch length must be a multiple of ${RECORD_BYTES} bytes`);
+  }
+  const n = buf.length / RECORD_BYTES;
+  const batch = allocBatch(n);
+  const view = new DataView(buf.buffer, buf.byteOffset, buf.byteLength);
+  for (let i = 0, o = 0; i < n; i++, o += RECORD_BYTES) {
+    batch.deviceIds[i] = view.getUint32(o, true);
+    batch.batteries[i] = view.getFloat32(o + 4, true);
+    batch.times[i] = view.getFloat64(o + 8, true);
+    batch.values[i] = view.getFloat64(o + 16, true);
+  }
+  return batch;
+}
+
+function decodeJSON(body) {
+  const records = Array.isArray(body) ? body : body && body.readings;
+  if (!Array.isArray(records)) throw new Error("expected an array of readings");
+
+  const batch = allocBatch(records.length);
+  for (let i = 0; i < records.length; i++) {
+    const r = records[i] || {};
+    const id = r.deviceId ?? r.device_id;
+    // checked before the Uint32Array, which would truncate 10.7 to 10 and wrap -1
+    batch.deviceIds[i] = Number.isInteger(id) && id > 0 && id <= 0xffffffff ? id : 0;
+    batch.times[i] = typeof r.timestamp === "number" ? r.timestamp : NaN;
+    batch.values[i] = typeof r.value === "number" ? r.value : NaN;
+    batch.batteries[i] = typeof r.battery === "number" ? r.battery : NaN;
+  }
+  return batch;
+}
+
+// Encode records into the binary format (gateways, tests and benchmarks).
+function encodeBinary(records) {
+  const buf = Buffer.alloc(records.length * RECORD_BYTES);
+  records.forEach((r, i) => {
+    const o = i * RECORD_BYTES;
+    buf.writeUInt32LE(r.deviceId, o);
+    buf.writeFloatLE(r.battery ?? NaN, o + 4);
+    buf.writeDoubleLE(r.timestamp, o + 8);
+    buf.writeDoubleLE(r.value, o + 16);
+  });
+  return buf;
+}
+
+module.exports = { RECORD_BYTES, decodeBinary, decodeJSON, encodeBinary };
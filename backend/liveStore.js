@@ -0,0 +1,188 @@
+// backend/liveStore.js
+// Compact in-memory live telemetry state.
+//
+// Readings for every device live in a few shared typed arrays (one fixed-size
+// ring per device slot), so appending a reading is O(1) and per-device history
+// costs capacity * 12 bytes instead of an array of { time, value } objects.
+// Serialization writes JSON straight from the buffers. An AnalyticsEngine may
+// attach itself as store.analytics to follow every push.
+//
+// Removed devices leave the lookups and their patient's list but keep their
+// slot (and their entry in `devices`, flagged `removed`): slots are never
+// reused, so a slot is always the device's index in `devices`.
+
+const MAX_READINGS = 30; // readings kept per device (ring capacity)
+
+const KIND_OTHER = 0;
+const KIND_HEART = 1;
+const KIND_TEMPERATURE = 2;
+
+function deviceKind(name) {
+  const lower = name.toLowerCase();
+  if (lower.includes("heart")) return KIND_HEART;
+  if (lower.includes("temperature")) return KIND_TEMPERATURE;
+  return KIND_OTHER;
+}
+
+class Patient {
+  constructor(id, name) {
+    this.id = id;
+    this.devices = [];
+    this.rename(name);
+  }
+
+  rename(name) {
+    this.name = name;
+    this.nameJson = JSON.stringify(name);
+  }
+}
+
+class Device {
+  constructor(id, name, patient, slot) {
+    this.id = id;
+    this.patient = patient;
+    this.slot = slot;
+    this.removed = false;
+    this.rename(name);
+  }
+
+  rename(name) {
+    this.name = name;
+    this.nameJson = JSON.stringify(name);
+    this.kind = deviceKind(name);
+  }
+}
+
+class LiveStore {
+  constructor({ capacity = MAX_READINGS, initialSlots = 1024 } = {}) {
+    this.capacity = capacity;
+    this.patients = [];
+    this.devices = [];
+    this.patientsById = new Map();
+    this.devicesById = new Map();
+    this.analytics = null;
+    this._allocate(initialSlots);
+  }
+
+  _allocate(slots) {
+    const grow = (Type, old, width = 1) => {
+      const next = new Type(slots * width);
+      if (old) next.set(old);
+      return next;
+    };
+    this.times = grow(Uint32Array, this.times, this.capacity); // epoch seconds
+    this.values = grow(Float64Array, this.values, this.capacity);
+    this.heads = grow(Uint32Array, this.heads); // next write position per slot
+    this.counts = grow(Uint32Array, this.counts);
+    this.battery = grow(Float64Array, this.battery);
+    this.lastBatteryDrop = grow(Float64Array, this.lastBatteryDrop); // ms
+    this.slots = slots;
+    if (this.analytics) this.analytics._allocate(slots);
+  }
+
+  addPatient(id, name) {
+    let patient = this.patientsById.get(id);
+    if (!patient) {
+      patient = new Patient(id, name);
+      this.patients.push(patient);
+      this.patientsById.set(id, patient);
+    }
+    return patient;
+  }
+
+  addDevice(patient, id, name, battery = 100) {
+    let device = this.devicesById.get(id);
+    if (device) return device;
+
+    const slot = this.devices.length;
+    if (slot >= this.slots) this._allocate(this.slots * 2);
+
+    device = new Device(id, name, patient, slot);
+    this.devices.push(device);
+    this.devicesById.set(id, device);
+    patient.devices.push(device);
+    this.battery[slot] = battery;
+    this.lastBatteryDrop[slot] = Date.now();
+    return device;
+  }
+
+  renameDevice(device, name) {
+    device.rename(name);
+    if (this.analytics) this.analytics.kinds[device.slot] = device.kind; // alert rules go by kind
+  }
+
+  removeDevice(device) {
+    if (device.removed) return;
+    device.removed = true;
+    this.devicesById.delete(device.id);
+    const siblings = device.patient.devices;
+    siblings.splice(siblings.indexOf(device), 1);
+    this.counts[device.slot] = 0; // no readings: no stats, never alerts
+  }
+
+  removePatient(patient) {
+    for (const device of patient.devices.slice()) this.removeDevice(device);
+    this.patientsById.delete(patient.id);
+    this.patients.splice(this.patients.indexOf(patient), 1);
+  }
+
+  push(device, time, value) {
+    const slot = device.slot;
+    if (this.analytics) this.analytics.update(slot, time, value);
+    const head = this.heads[slot];
+    const i = slot * this.capacity + head;
+    this.times[i] = time;
+    this.values[i] = value;
+    this.heads[slot] = head + 1 === this.capacity ? 0 : head + 1;
+    if (this.counts[slot] < this.capacity) this.counts[slot] += 1;
+  }
+
+  // Latest value for the device, or undefined when it has no readings yet.
+  lastValue(device) {
+    const slot = device.slot;
+    if (this.counts[slot] === 0) return undefined;
+    const head = this.heads[slot];
+    return this.values[slot * this.capacity + (head === 0 ? this.capacity - 1 : head - 1)];
+  }
+
+  // Time of the latest reading for the device, or undefined when it has none.
+  lastTime(device) {
+    const slot = device.slot;
+    if (this.counts[slot] === 0) return undefined;
+    const head = this.heads[slot];
+    return this.times[slot * this.capacity + (head === 0 ? this.capacity - 1 : head - 1)];
+  }
+
+  deviceJSON(device) {
+    const slot = device.slot;
+    const count = this.counts[slot];
+    const base = slot * this.capacity;
+    let i = (this.heads[slot] - count + this.capacity) % this.capacity;
+    let readings = "";
+    for (let n = 0; n < count; n++) {
+      readings += (n ? "," : "") + '{"time":' + this.times[base + i] + ',"value":' + this.values[base + i] + "}";
+      i = i + 1 === this.capacity ? 0 : i + 1;
+    }
+    return (
+      '{"id":' + device.id +
+      ',"name":' + device.nameJson +
+      ',"battery":' + this.battery[slot] +
+      ',"readings":[' + readings + "]" +
+      (this.analytics ? this.analytics.deviceFieldsJSON(slot) : "") + "}"
+    );
+  }
+
+  // Patients array as JSON (same shape /api/patients has always returned),
+  // optionally limited to a set of patient ids.
+  patientsJSON(patientIds = null) {
+    const parts = [];
+    for (const patient of this.patients) {
+      if (patientIds && !patientIds.has(patient.id)) continue;
+      const devices = patient.devices.map((d) => this.deviceJSON(d)).join(",");
+      parts.push('{"id":' + patient.id + ',"name":' + patient.nameJson + ',"devices":[' + devices + "]}");
+    }
+    return "[" + parts.join(",") + "]";
+  }
+}
+
+module.exports = { LiveStore, MAX_READINGS, KIND_OTHER, KIND_HEART, KIND_TEMPERATURE };
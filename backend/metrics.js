@@ -0,0 +1,178 @@
+// backend/metrics.js
+// Counters, gauges and histograms for the hot paths, rendered in the Prometheus
+// text format at GET /metrics.
+//
+// Metrics live in one registry per process and are registered by the code that
+// observes them. Registration is idempotent (the same name returns the same
+// metric), and counters/gauges may read their value from a callback at scrape
+// time instead of being incremented on the hot path.
+//
+// In cluster mode a scrape may land on any worker, so no worker answers from
+// its own registry alone: the primary collects snapshot() from every worker,
+// adds its own (tick, ingest, DB commits) and renderSnapshots() sums them.
+// Every worker then reports the same cluster-wide totals, which only grow.
+
+const DEFAULT_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10];
+
+// { route: "/api/patients" } -> 'route="/api/patients"'
+function labelKey(labels) {
+  if (!labels) return "";
+  return Object.keys(labels)
+    .map((k) => `${k}="${String(labels[k]).replace(/\\/g, "\\\\").replace(/"/g, '\\"').replace(/\n/g, "\\n")}"`)
+    .join(",");
+}
+
+class Counter {
+  constructor(name, help, { collect = null } = {}) {
+    this.name = name;
+    this.help = help;
+    this.type = "counter";
+    this.collect = collect; // () => number, read at scrape time
+    this.values = new Map(); // label key -> value
+  }
+
+  inc(n = 1, labels = null) {
+    const key = labelKey(labels);
+    this.values.set(key, (this.values.get(key) || 0) + n);
+  }
+
+  series() {
+    if (this.collect) return [["", this.collect()]];
+    return [...this.values];
+  }
+}
+
+class Gauge extends Counter {
+  constructor(name, help, options) {
+    super(name, help, options);
+    this.type = "gauge";
+  }
+
+  set(value, labels = null) {
+    this.values.set(labelKey(labels), value);
+  }
+}
+
+class Histogram {
+  constructor(name, help, { buckets = DEFAULT_BUCKETS } = {}) {
+    this.name = name;
+    this.help = help;
+    this.type = "histogram";
+    this.buckets = buckets;
+    this.values = new Map(); // label key -> { counts, sum, count }
+  }
+
+  observe(value, labels = null) {
+    const key = labelKey(labels);
+    let s = this.values.get(key);
+    if (!s) this.values.set(key, (s = { counts: new Array(this.buckets.length).fill(0), sum: 0, count: 0 }));
+    const buckets = this.buckets;
+    let i = 0;
+    while (i < buckets.length && value > buckets[i]) i++;
+    if (i < buckets.length) s.counts[i] += 1; // above the last bucket only counts toward +Inf
+    s.sum += value;
+    s.count += 1;
+  }
+
+  // Observe the seconds elapsed since `started` (a process.hrtime.bigint()).
+  observeSince(started, labels = null) {
+    this.observe(Number(process.hrtime.bigint() - started) / 1e9, labels);
+  }
+
+  series() {
+    return [...this.values];
+  }
+}
+
+class Registry {
+  constructor() {
+    this.metrics = new Map();
+  }
+
+  _register(Type, name, help, options) {
+    let metric = this.metrics.get(name);
+    if (!metric) {
+      metric = new Type(name, help, options);
+      this.metrics.set(name, metric);
+    } else if (options && options.collect) {
+      metric.collect = options.collect; // re-registered by a new instance (e.g. a new Fanout)
+    }
+    return metric;
+  }
+
+  counter(name, help, options) {
+    return this._register(Counter, name, help, options);
+  }
+
+  gauge(name, help, options) {
+    return this._register(Gauge, name, help, options);
+  }
+
+  histogram(name, help, options) {
+    return this._register(Histogram, name, help, options);
+  }
+
+  // Plain-object copy of every series (sent over cluster IPC).
+  snapshot() {
+    const out = {};
+    for (const m of this.metrics.values()) {
+      out[m.name] = { type: m.type, help: m.help, buckets: m.buckets, series: m.series() };
+    }
+    return out;
+  }
+
+  // Prometheus text format; series from `extra` snapshots are added to ours.
+  render(extra = []) {
+    return renderSnapshots([this.snapshot(), ...extra]);
+  }
+}
+
+// Prometheus text format for the sum of several snapshots (same name and
+// labels: counters and gauges add up, histogram buckets are merged).
+function renderSnapshots(snapshots) {
+  const families = new Map();
+  for (const snap of snapshots) {
+    if (!snap) continue;
+    for (const [name, family] of Object.entries(snap)) {
+      let merged = families.get(name);
+      if (!merged) families.set(name, (merged = { ...family, series: new Map() }));
+      for (const [key, value] of family.series) {
+        const prev = merged.series.get(key);
+        if (prev === undefined) {
+          merged.series.set(key, family.type === "histogram" ? { ...value, counts: [...value.counts] } : value);
+        } else if (family.type === "histogram") {
+          value.counts.forEach((c, i) => (prev.counts[i] += c));
+          prev.sum += value.sum;
+          prev.count += value.count;
+        } else {
+          merged.series.set(key, prev + value);
+        }
+      }
+    }
+  }
+
+  const lines = [];
+  for (const [name, family] of families) {
+    lines.push(`# HELP ${name} ${family.help}`, `# TYPE ${name} ${family.type}`);
+    for (const [key, value] of family.series) {
+      if (family.type !== "histogram") {
+        lines.push(`${name}${key ? `{${key}}` : ""} ${value}`);
+        continue;
+      }
+      const sep = key ? "," : "";
+      let cumulative = 0;
+      family.buckets.forEach((le, i) => {
+        cumulative += value.counts[i];
+        lines.push(`${name}_bucket{${key}${sep}le="${le}"} ${cumulative}`);
+      });
+      lines.push(`${name}_bucket{${key}${sep}le="+Inf"} ${value.count}`);
+      lines.push(`${name}_sum${key ? `{${key}}` : ""} ${value.sum}`);
+      lines.push(`${name}_count${key ? `{${key}}` : ""} ${value.count}`);
+    }
+  }
+  return lines.join("\n") + "\n";
+}
+
+const registry = new Registry();
+
+module.exports = { Registry, Counter, Gauge, Histogram, DEFAULT_BUCKETS, registry, renderSnapshots };
@@ -0,0 +1,75 @@
+// backend/mirror.js
+// Read-only copy of the producer's live state, kept by web worker processes.
+// The producer sends a full "init" (patients JSON with stats and alert levels),
+// "add" messages with only the patients that gained devices, and per-tick
+// deltas; nothing is recomputed here.
+
+const { LiveStore, MAX_READINGS } = require("./liveStore");
+const { AnalyticsEngine, LEVELS } = require("./analytics");
+const { SummaryCache } = require("./summaries");
+
+// Holds the producer's stats columns without computing them.
+class AnalyticsMirror extends AnalyticsEngine {
+  update() {}
+
+  apply(slot, stats, alertLevel) {
+    if (stats) {
+      this.ewma[slot] = stats.ewma;
+      this.mean[slot] = stats.mean;
+      this.min[slot] = stats.min;
+      this.max[slot] = stats.max;
+      this.z[slot] = stats.z;
+      this.rate[slot] = stats.rate;
+    }
+    if (alertLevel !== undefined) this.level[slot] = Math.max(0, LEVELS.indexOf(alertLevel));
+  }
+}
+
+class LiveMirror {
+  constructor() {
+    this.store = new LiveStore({ capacity: MAX_READINGS });
+    this.analytics = new AnalyticsMirror(this.store);
+    this.summaries = new SummaryCache(this.store);
+    this.producerStats = {};
+  }
+
+  // Replace the whole state from the producer's patients JSON.
+  load(patientsJson) {
+    const patients = JSON.parse(patientsJson);
+    const store = new LiveStore({ capacity: MAX_READINGS, initialSlots: Math.max(1024, patients.length * 2) });
+    const analytics = new AnalyticsMirror(store);
+    this._addPatients(store, analytics, patients);
+    this.store = store;
+    this.analytics = analytics;
+  }
+
+  // Add patients/devices the mirror does not have yet (producer resync).
+  add(patientsJson) {
+    this._addPatients(this.store, this.analytics, JSON.parse(patientsJson));
+  }
+
+  _addPatients(store, analytics, patients) {
+    for (const p of patients) {
+      const patient = store.addPatient(p.id, p.name);
+      for (const d of p.devices) {
+        if (store.devicesById.has(d.id)) continue;
+        const device = store.addDevice(patient, d.id, d.name, d.battery);
+        for (const r of d.readings) store.push(device, r.time, r.value);
+        analytics.apply(device.slot, d.stats, d.alertLevel);
+      }
+    }
+  }
+
+  applyTick(changes) {
+    const { store, analytics } = this;
+    for (const change of changes) {
+      const device = store.devicesById.get(change.id);
+      if (!device) continue; // arrives with the next init
+      for (const point of change.points) store.push(device, point.time, point.value);
+      if (change.battery !== undefined) store.battery[device.slot] = change.battery;
+      analytics.apply(device.slot, change.stats, change.alertLevel);
+    }
+  }
+}
+
+module.exports = { LiveMirror };
@@ -0,0 +1,26 @@
+-- CreateTable
+CREATE TABLE "ReadingRollup1m" (
+    "deviceId" INTEGER NOT NULL,
+    "bucket" TIMESTAMP(3) NOT NULL,
+    "min" DOUBLE PRECISION NOT NULL,
+    "max" DOUBLE PRECISION NOT NULL,
+    "avg" DOUBLE PRECISION NOT NULL,
+    "count" INTEGER NOT NULL,
+
+    CONSTRAINT "ReadingRollup1m_pkey" PRIMARY KEY ("deviceId","bucket")
+);
+
+-- CreateTable
+CREATE TABLE "ReadingRollup1h" (
+    "deviceId" INTEGER NOT NULL,
+    "bucket" TIMESTAMP(3) NOT NULL,
+    "min" DOUBLE PRECISION NOT NULL,
+    "max" DOUBLE PRECISION NOT NULL,
+    "avg" DOUBLE PRECISION NOT NULL,
+    "count" INTEGER NOT NULL,
+
+    CONSTRAINT "ReadingRollup1h_pkey" PRIMARY KEY ("deviceId","bucket")
+);
+
+-- CreateIndex
+CREATE INDEX "Reading_deviceId_timestamp_idx" ON "Reading"("deviceId", "timestamp");
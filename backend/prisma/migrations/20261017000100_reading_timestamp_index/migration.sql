@@ -0,0 +1,2 @@
+-- CreateIndex
+CREATE INDEX "Reading_timestamp_idx" ON "Reading"("timestamp");
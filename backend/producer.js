@@ -0,0 +1,360 @@
+// backend/producer.js
+// The producing side of the backend: live state, analytics, summaries, the
+// simulation tick, the write-behind queue and rollup jobs. Exactly one process
+// runs a Producer; web processes fan its events out to clients.
+//
+// Events:
+//   "tick"      (changes)  per-device deltas for one tick
+//   "resync"    (ids)      patients/devices were added; ids of the patients affected
+//   "reload"    ()         patients/devices were removed or renamed; copies of the
+//                          live state must be rebuilt as a whole
+//   "summaries" (cache)    the SummaryCache has a new version
+//
+// Readings arrive from the simulation tick and from ingest() (devices posting
+// real data). Devices that ingested recently are left out of the simulation.
+// Ingested points wait in pendingChanges and enter the live store inside the
+// next tick, right before that tick's deltas are emitted, so a snapshot never
+// holds a point that a later delta would send again. Each device's ring stays
+// in time order: a late point older than the newest one already stored is
+// persisted but left out of the live state.
+
+const { EventEmitter } = require("events");
+const { WriteBehindQueue } = require("./writeQueue");
+const { LiveStore, MAX_READINGS, KIND_HEART, KIND_TEMPERATURE } = require("./liveStore");
+const { RollupJobs, retentionFromEnv } = require("./rollups");
+const { SummaryCache } = require("./summaries");
+const { AnalyticsEngine, rulesFromEnv } = require("./analytics");
+const { registry } = require("./metrics");
+
+const EXTERNAL_HOLD_MS = 10_000; // how long an ingesting device is exempt from simulation
+const MAX_CLOCK_SKEW_S = 60; // reject timestamps further in the future than this
+const MAX_LATENESS_S = 60; // reject timestamps older than this (well inside the 2 min rollup lag)
+
+class Producer extends EventEmitter {
+  constructor(prisma, env = process.env) {
+    super();
+    this.prisma = prisma;
+
+    // --- Metrics (registered here, so only the producing process reports them) ---
+    this.metrics = {
+      tick: registry.histogram("iot_tick_seconds", "Simulation tick: new readings, analytics and alert rules (before fan-out)"),
+      ingest: registry.histogram("iot_ingest_batch_seconds", "Applying one ingested batch to the live state"),
+      readings: registry.counter("iot_readings_total", "Readings applied to the live state (labels: source)"),
+      rejected: registry.counter("iot_ingest_rejected_total", "Ingested readings rejected by validation"),
+    };
+
+    // --- Write-behind queue for readings (bulk inserts, flushed on size or time) ---
+    this.writeQueue = new WriteBehindQueue(prisma, {
+      maxDepth: Number(env.WRITE_QUEUE_MAX || 50_000),
+      batchSize: Number(env.WRITE_BATCH_SIZE || 1_000),
+      flushMs: Number(env.WRITE_FLUSH_MS || 1_000),
+    });
+
+    // --- Rollups (1m / 1h aggregates) and retention of raw readings ---
+    this.retention = retentionFromEnv(env);
+    // minutes with readings still in the write queue are not rolled up yet
+    this.rollupJobs = new RollupJobs(prisma, {
+      ...this.retention,
+      pendingSince: () => this.writeQueue.oldestPending(),
+    });
+
+    // --- In-memory live state: loaded from the DB, then advanced by each tick ---
+    // The DB lags behind by up to one write-queue flush, so reads are served from here.
+    this.store = new LiveStore({ capacity: MAX_READINGS });
+
+    // --- Streaming per-device stats and alert levels (follows every store push) ---
+    this.analytics = new AnalyticsEngine(this.store, { rules: rulesFromEnv(env.ALERT_RULES) });
+
+    // --- Latest health summary per patient (served from memory with ETags) ---
+    this.summaries = new SummaryCache(this.store, { intervalMs: Number(env.SUMMARY_INTERVAL_MS || 30_000) });
+    this.summaries.onChange = () => this.emit("summaries", this.summaries);
+
+    // --- Device ingestion: pending deltas for the next tick, devices fed externally ---
+    this.simulate = env.SIMULATE !== "0";
+    this.pendingChanges = new Map(); // deviceId -> change
+    this.externalUntil = new Map(); // deviceId -> ms timestamp
+    this.ingestStats = { batches: 0, accepted: 0, rejected: 0 };
+    registry.gauge("iot_live_devices", "Devices in the live store", { collect: () => this.store.devicesById.size });
+
+    this.tickInFlight = false;
+    this.simulationTimer = null;
+    this.syncTimer = null;
+  }
+
+  // --- Latest MAX_READINGS readings of the given devices ---
+  // One set-based query: a LATERAL join on the (deviceId, timestamp) index.
+  async fetchLatestReadings(deviceIds) {
+    const rows = await this.prisma.$queryRaw`
+      SELECT d."id" AS "deviceId", r."timestamp", r."value"
+      FROM "Device" d
+      CROSS JOIN LATERAL (
+        SELECT "timestamp", "value" FROM "Reading"
+        WHERE "deviceId" = d."id"
+        ORDER BY "timestamp" DESC
+        LIMIT ${MAX_READINGS}
+      ) r
+      WHERE d."id" = ANY(${deviceIds})
+      ORDER BY d."id", r."timestamp"`;
+
+    const readingsByDevice = new Map();
+    for (const r of rows) {
+      let readings = readingsByDevice.get(r.deviceId);
+      if (!readings) readingsByDevice.set(r.deviceId, (readings = []));
+      readings.push({ time: Math.floor(new Date(r.timestamp).getTime() / 1000), value: r.value });
+    }
+    return readingsByDevice;
+  }
+
+  // Bring the live store in line with the Patient/Device tables: add new rows
+  // (with their latest readings), rename changed ones and remove deleted ones,
+  // so they are no longer simulated or persisted. Readings are only fetched
+  // for devices the store does not have yet.
+  async syncLiveState() {
+    const store = this.store;
+    const patients = await this.prisma.patient.findMany({ include: { devices: true } });
+    const newDeviceIds = [];
+    for (const p of patients) for (const d of p.devices) if (!store.devicesById.has(d.id)) newDeviceIds.push(d.id);
+    const readings = newDeviceIds.length ? await this.fetchLatestReadings(newDeviceIds) : new Map();
+
+    const added = new Set(); // patients that are new or gained devices
+    let changed = false; // something was removed or renamed
+    const seenPatients = new Set();
+    const seenDevices = new Set();
+
+    for (const p of patients) {
+      seenPatients.add(p.id);
+      let patient = store.patientsById.get(p.id);
+      if (!patient) {
+        patient = store.addPatient(p.id, p.name);
+        added.add(p.id);
+      } else if (patient.name !== p.name) {
+        patient.rename(p.name);
+        changed = true;
+      }
+
+      for (const d of p.devices) {
+        seenDevices.add(d.id);
+        let device = store.devicesById.get(d.id);
+        if (device && device.patient !== patient) {
+          store.removeDevice(device); // moved to another patient: re-added below
+          device = null;
+          changed = true;
+        }
+        if (!device) {
+          device = store.addDevice(patient, d.id, d.name, d.battery ?? 100);
+          for (const r of readings.get(d.id) || []) store.push(device, r.time, r.value);
+          added.add(p.id);
+        } else if (device.name !== d.name) {
+          store.renameDevice(device, d.name);
+          changed = true;
+        }
+      }
+    }
+
+    for (const patient of store.patients.slice()) {
+      if (seenPatients.has(patient.id)) continue;
+      store.removePatient(patient);
+      changed = true;
+    }
+    for (const device of [...store.devicesById.values()]) {
+      if (seenDevices.has(device.id)) continue;
+      store.removeDevice(device);
+      changed = true;
+    }
+
+    this.analytics.evaluate();
+    if (changed) this.emit("reload");
+    else if (added.size) this.emit("resync", added);
+  }
+
+  // --- Simulation tick ---
+  async simulationTick() {
+    if (this.tickInFlight) return; // previous tick still waiting on the write queue
+    this.tickInFlight = true;
+    const { store, analytics } = this;
+    try {
+      const started = process.hrtime.bigint();
+      const now = Date.now();
+      const time = Math.floor(now / 1000);
+      const readings = [];
+      const changes = [];
+      const slots = [];
+      const external = this.externalUntil;
+
+      for (const d of this.simulate ? store.devices : []) {
+        const slot = d.slot;
+        if (d.removed) continue;
+        if (external.size && external.get(d.id) > now) continue; // fed by ingest()
+
+        // Determine baseline and variation
+        let baseline = 75, variation = 0.5;
+        if (d.kind === KIND_HEART) { baseline = 70; variation = 1; }
+        if (d.kind === KIND_TEMPERATURE) { baseline = 98.6; variation = 0.2; }
+
+        const prevValue = store.lastValue(d) ?? baseline;
+        let newValue = prevValue + (baseline - prevValue) * 0.05 + (Math.random() - 0.5) * variation;
+
+        // enforce realistic floors
+        if (d.kind === KIND_HEART) newValue = Math.max(50, newValue);
+        if (d.kind === KIND_TEMPERATURE) newValue = Math.max(95, newValue);
+
+        let battery = store.battery[slot];
+        if (battery <= 0) battery = 100; // reset if drained
+        if (now - store.lastBatteryDrop[slot] > 60_000) {
+          battery = Math.max(0, battery - 1); // reduce once per minute
+          store.lastBatteryDrop[slot] = now;
+        }
+        battery = parseFloat(battery.toFixed(1));
+
+        const value = parseFloat(newValue.toFixed(2));
+        store.push(d, time, value);
+
+        const change = { id: d.id, patientId: d.patient.id, points: [{ time, value }] };
+        if (battery !== store.battery[slot]) {
+          store.battery[slot] = battery;
+          change.battery = battery;
+        }
+        changes.push(change);
+        slots.push(slot);
+        readings.push({ deviceId: d.id, value, battery, timestamp: new Date(now) });
+      }
+
+      // Points ingested since the last tick enter the store now, just before broadcast
+      for (const change of this.pendingChanges.values()) {
+        const device = store.devicesById.get(change.id);
+        if (!device) continue; // removed since it was ingested
+        // batches may arrive out of order; points older than the ring's newest
+        // would break lastValue(), rate and the charts
+        change.points.sort((a, b) => a.time - b.time);
+        const newest = store.lastTime(device);
+        if (newest !== undefined && change.points[0].time < newest) {
+          change.points = change.points.filter((point) => point.time >= newest);
+        }
+        for (const point of change.points) store.push(device, point.time, point.value);
+        if (change.battery !== undefined) {
+          if (change.battery === store.battery[device.slot]) delete change.battery;
+          else store.battery[device.slot] = change.battery;
+        }
+        if (change.points.length === 0 && change.battery === undefined) continue;
+        // only the last `capacity` points survive in the ring, so only those are sent
+        if (change.points.length > store.capacity) change.points = change.points.slice(-store.capacity);
+        changes.push(change);
+        slots.push(device.slot);
+      }
+      this.pendingChanges.clear();
+      for (const [id, until] of external) if (until <= now) external.delete(id);
+
+      // Alert rules for every device in one pass, then attach stats to the deltas
+      const previousLevels = analytics.evaluate();
+      changes.forEach((change, i) => {
+        const slot = slots[i];
+        change.stats = analytics.stats(slot);
+        if (analytics.level[slot] !== previousLevels[slot]) change.alertLevel = analytics.alertLevel(slot);
+      });
+      this.metrics.tick.observeSince(started);
+      this.metrics.readings.inc(readings.length, { source: "simulated" });
+
+      // Broadcast updated readings to frontend
+      this.emit("tick", changes);
+
+      // Hand readings to the write-behind queue (waits only if the queue is full)
+      await this.writeQueue.enqueue(readings);
+    } catch (err) {
+      console.error("Simulation tick error:", err);
+    } finally {
+      this.tickInFlight = false;
+    }
+  }
+
+  // --- Device ingestion ---
+  // Apply a decoded batch ({ n, deviceIds, times, values, batteries }, see
+  // ingest.js). Readings for unknown devices, non-finite values and timestamps
+  // in the future or over MAX_LATENESS_S old are rejected; the rest go through
+  // the same path as simulated ones (next tick: live store, analytics, deltas;
+  // now: write-behind queue). Resolves once the readings are queued, so a full
+  // queue pushes back on senders.
+  async ingest(batch) {
+    const { store } = this;
+    const { n, deviceIds, times, values, batteries } = batch;
+    const started = process.hrtime.bigint();
+    const now = Date.now();
+    const maxTime = now / 1000 + MAX_CLOCK_SKEW_S;
+    // Older readings could land in a minute that is already rolled up (so they
+    // would never reach /api/history) and be pruned early. The lateness bound
+    // leaves a minute of the rollup lag for the write queue to flush them, and
+    // the rollup waits for anything still queued beyond that.
+    const minTime = now / 1000 - MAX_LATENESS_S;
+    const readings = [];
+
+    for (let i = 0; i < n; i++) {
+      const device = store.devicesById.get(deviceIds[i]);
+      const t = times[i];
+      const value = values[i];
+      if (!device || !(t >= minTime && t <= maxTime) || !Number.isFinite(value)) continue;
+
+      const time = Math.floor(t);
+      let change = this.pendingChanges.get(device.id);
+      if (!change) {
+        change = { id: device.id, patientId: device.patient.id, points: [] };
+        this.pendingChanges.set(device.id, change);
+      }
+      change.points.push({ time, value });
+
+      const battery = batteries[i];
+      const reading = { deviceId: device.id, value, timestamp: new Date(t * 1000) };
+      if (battery >= 0 && battery <= 100) {
+        const rounded = Math.round(battery * 10) / 10;
+        change.battery = rounded; // applied (and dropped if unchanged) by the tick
+        reading.battery = rounded;
+      }
+      this.externalUntil.set(device.id, now + EXTERNAL_HOLD_MS);
+      readings.push(reading);
+    }
+
+    const result = { accepted: readings.length, rejected: n - readings.length };
+    this.ingestStats.batches += 1;
+    this.ingestStats.accepted += result.accepted;
+    this.ingestStats.rejected += result.rejected;
+    this.metrics.ingest.observeSince(started);
+    this.metrics.readings.inc(result.accepted, { source: "ingested" });
+    this.metrics.rejected.inc(result.rejected);
+
+    await this.writeQueue.enqueue(readings);
+    return result;
+  }
+
+  // Start simulation loop once the live state is loaded
+  async start() {
+    this.writeQueue.start();
+    this.rollupJobs.start();
+    try {
+      await this.syncLiveState();
+    } catch (err) {
+      console.error("Initial live state load failed:", err);
+    }
+    this.summaries.start();
+    this.simulationTimer = setInterval(() => this.simulationTick(), 1000);
+    this.syncTimer = setInterval(() => {
+      this.syncLiveState().catch((err) => console.error("Live state sync error:", err));
+    }, 60_000);
+  }
+
+  // Stop producing, then drain queued readings.
+  async stop() {
+    clearInterval(this.simulationTimer);
+    clearInterval(this.syncTimer);
+    this.summaries.stop();
+    await this.rollupJobs.stop();
+    await this.writeQueue.drain();
+    console.log("Write queue drained:", this.writeQueue.stats());
+  }
+
+  stats() {
+    return {
+      ingest: { ...this.writeQueue.stats(), devices: this.ingestStats },
+      rollups: this.rollupJobs.stats(),
+    };
+  }
+}
+
+module.exports = { Producer };
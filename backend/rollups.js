@@ -0,0 +1,235 @@
+// backend/rollups.js
+// Time-series maintenance for Reading: 1-minute and 1-hour min/max/avg/count
+// rollups, chunked retention of raw rows, and a resolution-aware history query.
+
+const { Prisma } = require("@prisma/client");
+
+const MINUTE_MS = 60_000;
+const HOUR_MS = 60 * MINUTE_MS;
+const DAY_MS = 24 * HOUR_MS;
+
+const floorTo = (ms, step) => Math.floor(ms / step) * step;
+
+class RollupJobs {
+  constructor(prisma, {
+    intervalMs = MINUTE_MS,
+    lagMs = 2 * MINUTE_MS, // wait for the write-behind queue before closing a minute
+    pendingSince = null, // () => ms time of the oldest reading not yet written, or null
+    maxMinutesPerRun = 60, // catch up gradually after downtime
+    rawRetentionDays = 7,
+    minuteRetentionDays = 90,
+    pruneChunk = 10_000,
+  } = {}) {
+    this.prisma = prisma;
+    this.intervalMs = intervalMs;
+    this.lagMs = lagMs;
+    this.pendingSince = pendingSince;
+    this.maxMinutesPerRun = maxMinutesPerRun;
+    this.rawRetentionDays = rawRetentionDays;
+    this.minuteRetentionDays = minuteRetentionDays;
+    this.pruneChunk = pruneChunk;
+
+    this.minuteMark = null; // rollups are complete for buckets before these
+    this.hourMark = null;
+    this.timer = null;
+    this.running = null;
+    this.counters = { runs: 0, errors: 0, minuteBuckets: 0, hourBuckets: 0, prunedRaw: 0, prunedMinute: 0, lastRunMs: 0 };
+  }
+
+  start() {
+    if (this.timer) return;
+    this.timer = setInterval(() => this.run(), this.intervalMs);
+  }
+
+  async stop() {
+    if (this.timer) clearInterval(this.timer);
+    this.timer = null;
+    await this.running;
+  }
+
+  run() {
+    if (!this.running) {
+      this.running = this._run().finally(() => {
+        this.running = null;
+      });
+    }
+    return this.running;
+  }
+
+  async _run() {
+    const started = Date.now();
+    try {
+      await this._loadMarks();
+      await this.rollupMinutes();
+      await this.rollupHours();
+      await this.prune();
+      this.counters.runs += 1;
+    } catch (err) {
+      this.counters.errors += 1;
+      console.error("Rollup job error:", err);
+    }
+    this.counters.lastRunMs = Date.now() - started;
+  }
+
+  async _loadMarks() {
+    if (this.minuteMark !== null) return;
+    const [m] = await this.prisma.$queryRaw`SELECT max("bucket") AS b FROM "ReadingRollup1m"`;
+    const [h] = await this.prisma.$queryRaw`SELECT max("bucket") AS b FROM "ReadingRollup1h"`;
+    const [r] = await this.prisma.$queryRaw`SELECT min("timestamp") AS b FROM "Reading"`;
+    const fallback = r.b ? floorTo(r.b.getTime(), HOUR_MS) : floorTo(Date.now(), HOUR_MS);
+    // the newest stored bucket may have been partial, so redo it
+    this.minuteMark = m.b ? m.b.getTime() : fallback;
+    this.hourMark = h.b ? h.b.getTime() : floorTo(this.minuteMark, HOUR_MS);
+  }
+
+  // Re-aggregate whole minutes in [minuteMark, to) from raw rows (idempotent upsert).
+  async rollupMinutes() {
+    let limit = floorTo(Date.now() - this.lagMs, MINUTE_MS);
+    // a minute with readings still queued (e.g. while the DB is down) stays open
+    const pending = this.pendingSince ? this.pendingSince() : null;
+    if (pending !== null) limit = Math.min(limit, floorTo(pending, MINUTE_MS));
+    const to = Math.min(limit, this.minuteMark + this.maxMinutesPerRun * MINUTE_MS);
+    if (to <= this.minuteMark) return;
+
+    const n = await this.prisma.$executeRaw`
+      INSERT INTO "ReadingRollup1m" ("deviceId", "bucket", "min", "max", "avg", "count")
+      SELECT "deviceId", date_trunc('minute', "timestamp"), min("value"), max("value"), avg("value"), count(*)::int
+      FROM "Reading"
+      WHERE "timestamp" >= ${new Date(this.minuteMark)} AND "timestamp" < ${new Date(to)}
+      GROUP BY 1, 2
+      ON CONFLICT ("deviceId", "bucket") DO UPDATE
+        SET "min" = EXCLUDED."min", "max" = EXCLUDED."max", "avg" = EXCLUDED."avg", "count" = EXCLUDED."count"`;
+    this.counters.minuteBuckets += n;
+    this.minuteMark = to;
+  }
+
+  // Re-aggregate whole hours in [hourMark, to) from the minute rollups.
+  async rollupHours() {
+    const to = floorTo(this.minuteMark, HOUR_MS);
+    if (to <= this.hourMark) return;
+
+    const n = await this.prisma.$executeRaw`
+      INSERT INTO "ReadingRollup1h" ("deviceId", "bucket", "min", "max", "avg", "count")
+      SELECT "deviceId", date_trunc('hour', "bucket"), min("min"), max("max"),
+             sum("avg" * "count") / sum("count"), sum("count")::int
+      FROM "ReadingRollup1m"
+      WHERE "bucket" >= ${new Date(this.hourMark)} AND "bucket" < ${new Date(to)}
+      GROUP BY 1, 2
+      ON CONFLICT ("deviceId", "bucket") DO UPDATE
+        SET "min" = EXCLUDED."min", "max" = EXCLUDED."max", "avg" = EXCLUDED."avg", "count" = EXCLUDED."count"`;
+    this.counters.hourBuckets += n;
+    this.hourMark = to;
+  }
+
+  // Delete expired rows in chunks so a large backlog never holds long locks.
+  // Raw rows are only pruned once they have been rolled up.
+  async prune() {
+    const rawCutoff = new Date(Math.min(Date.now() - this.rawRetentionDays * DAY_MS, this.minuteMark));
+    this.counters.prunedRaw += await this._pruneChunks((chunk) => this.prisma.$executeRaw`
+      DELETE FROM "Reading" WHERE "id" IN (
+        SELECT "id" FROM "Reading" WHERE "timestamp" < ${rawCutoff} LIMIT ${chunk})`);
+
+    const minuteCutoff = new Date(Math.min(Date.now() - this.minuteRetentionDays * DAY_MS, this.hourMark));
+    this.counters.prunedMinute += await this._pruneChunks((chunk) => this.prisma.$executeRaw`
+      DELETE FROM "ReadingRollup1m" WHERE ("deviceId", "bucket") IN (
+        SELECT "deviceId", "bucket" FROM "ReadingRollup1m" WHERE "bucket" < ${minuteCutoff} LIMIT ${chunk})`);
+  }
+
+  async _pruneChunks(deleteChunk) {
+    let total = 0;
+    for (;;) {
+      const n = await deleteChunk(this.pruneChunk);
+      total += n;
+      if (n < this.pruneChunk || !this.timer) return total;
+      await new Promise((resolve) => setImmediate(resolve)); // let the tick run
+    }
+  }
+
+  stats() {
+    return {
+      minuteMark: this.minuteMark && new Date(this.minuteMark).toISOString(),
+      hourMark: this.hourMark && new Date(this.hourMark).toISOString(),
+      ...this.counters,
+    };
+  }
+}
+
+// --- History query: raw rows for short spans, rollups for long ones ---
+
+// Pick the coarsest source that still gives ~maxPoints over the span, and never
+// read raw rows or minute rollups outside their retention window. Raw assumes
+// one reading per second; queryHistory falls back to rollups for busier devices.
+function chooseResolution(fromMs, toMs, maxPoints, { rawRetentionDays, minuteRetentionDays }) {
+  const span = toMs - fromMs;
+  const now = Date.now();
+  if (span / 1000 <= maxPoints && fromMs >= now - rawRetentionDays * DAY_MS) return "raw";
+  if (span / HOUR_MS <= maxPoints && fromMs >= now - minuteRetentionDays * DAY_MS) return "1m";
+  return "1h";
+}
+
+async function queryHistory(prisma, { deviceId, from, to, maxPoints }, retention) {
+  const fromMs = from.getTime();
+  const toMs = to.getTime();
+  let resolution = chooseResolution(fromMs, toMs, maxPoints, retention);
+
+  if (resolution === "raw") {
+    // one row over budget means the device reports faster than 1 Hz: rather
+    // than cut off the newest part of the range, aggregate it by the minute
+    const rows = await prisma.$queryRaw`
+      SELECT "timestamp", "value" FROM "Reading"
+      WHERE "deviceId" = ${deviceId} AND "timestamp" >= ${from} AND "timestamp" < ${to}
+      ORDER BY "timestamp"
+      LIMIT ${maxPoints + 1}`;
+    if (rows.length <= maxPoints) {
+      return {
+        deviceId,
+        resolution,
+        points: rows.map((r) => ({ time: Math.floor(r.timestamp.getTime() / 1000), value: r.value })),
+      };
+    }
+    resolution = fromMs >= Date.now() - retention.minuteRetentionDays * DAY_MS ? "1m" : "1h";
+  }
+
+  // Regroup rollup buckets so the response stays within maxPoints. Rollups only
+  // exist for closed buckets, so the rest of the range (after the device's last
+  // rolled-up bucket, i.e. the last few minutes or the current hour) is filled
+  // from raw rows.
+  const step = resolution === "1m" ? MINUTE_MS : HOUR_MS;
+  const stepSec = step / 1000;
+  const widthSec = Math.max(step, Math.ceil((toMs - fromMs) / maxPoints / step) * step) / 1000;
+  const table = resolution === "1m" ? Prisma.sql`"ReadingRollup1m"` : Prisma.sql`"ReadingRollup1h"`;
+  const rows = await prisma.$queryRaw`
+    WITH rolled AS (
+      SELECT "bucket", "min", "max", "avg", "count" FROM ${table}
+      WHERE "deviceId" = ${deviceId} AND "bucket" >= ${from} AND "bucket" < ${to}
+    ), tail AS (
+      SELECT COALESCE(max("bucket") + ${stepSec}::int * interval '1 second', ${from}) AS start FROM rolled
+    ), combined AS (
+      SELECT * FROM rolled
+      UNION ALL
+      SELECT r."timestamp", r."value", r."value", r."value", 1 FROM "Reading" r, tail
+      WHERE r."deviceId" = ${deviceId} AND r."timestamp" >= tail.start AND r."timestamp" < ${to}
+    )
+    SELECT (floor(extract(epoch FROM "bucket") / ${widthSec}) * ${widthSec})::float8 AS t,
+           min("min") AS min, max("max") AS max,
+           (sum("avg" * "count") / sum("count"))::float8 AS avg, sum("count")::int AS count
+    FROM combined
+    GROUP BY 1
+    ORDER BY 1`;
+
+  return {
+    deviceId,
+    resolution,
+    bucketSeconds: widthSec,
+    points: rows.map((r) => ({ time: r.t, value: r.avg, min: r.min, max: r.max, count: r.count })),
+  };
+}
+
+function retentionFromEnv(env = process.env) {
+  return {
+    rawRetentionDays: Number(env.RAW_RETENTION_DAYS || 7),
+    minuteRetentionDays: Number(env.ROLLUP_1M_RETENTION_DAYS || 90),
+  };
+}
+
+module.exports = { RollupJobs, queryHistory, chooseResolution, retentionFromEnv };
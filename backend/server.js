@@ -3,18 +3,31 @@ require("dotenv").config();
 const path = require("path");
 const express = require("express");
 const http = require("http");
+const cluster = require("cluster");
 const { PrismaClient } = require("@prisma/client");
 const { WebSocketServer } = require("ws");
 const fs = require("fs");
-const prisma = new PrismaClient();
+const { Fanout } = require("./fanout");
+const { Producer } = require("./producer");
+const { LiveMirror } = require("./mirror");
+const { decodeBinary, decodeJSON } = require("./ingest");
+const { queryHistory, retentionFromEnv } = require("./rollups");
+const { registry, renderSnapshots } = require("./metrics");
+const prisma = new PrismaClient({ log: [{ emit: "event", level: "query" }] });
 const app = express();
 
+// --- DB query timings (Prisma query events) ---
+const dbQuerySeconds = registry.histogram("iot_db_query_seconds", "Prisma queries, as reported by the query engine");
+prisma.$on("query", (e) => dbQuerySeconds.observe(e.duration / 1000));
+const httpSeconds = registry.histogram("iot_http_request_seconds", "HTTP API requests (labels: route)");
+
 const cors = require('cors');
 
 // --- Enable CORS for local frontend dev ---
 app.use(cors({
   origin: ['http://localhost:5173', "https://health-iot-dashboard-frontend-1.onrender.com"],
   credentials: true,
+  exposedHeaders: ["ETag"],
 }));
 
 
@@ -43,155 +56,418 @@ let staticFolder = null;
 if (require("fs").existsSync(frontendDistVite)) staticFolder = frontendDistVite;
 else if (require("fs").existsSync(frontendDistCRA)) staticFolder = frontendDistCRA;
 
-// --- HTTP server + WebSocket ---
-const server = http.createServer(app);
-const wss = new WebSocketServer({ server });
-
-let clients = new Set();
+// --- Process roles ---
+// WEB_CONCURRENCY <= 1: one process simulates, persists and serves (standalone).
+// WEB_CONCURRENCY  > 1: the cluster primary runs the only Producer and relays its
+// events over IPC; N forked workers share the port and serve HTTP/WS from a
+// LiveMirror of the producer's state.
+const WEB_CONCURRENCY = Number(process.env.WEB_CONCURRENCY || 1);
+const MAX_PENDING_TICKS = 5; // unacked ticks before the primary stops sending to a worker
+const MAX_INGEST_BYTES = 16 * 1024 * 1024; // largest ingest batch (HTTP body or WS message)
+const MAX_INGEST_IN_FLIGHT = 4; // batches queued per ingest socket before it is paused
+const METRICS_TIMEOUT_MS = 1_000; // how long a scrape waits for a worker's snapshot
+
+if (cluster.isPrimary && WEB_CONCURRENCY > 1) {
+  startPrimary();
+} else {
+  startWeb();
+}
 
-// --- Helper to fetch patients with devices and readings ---
-async function fetchPatientsWithReadings() {
-  const patients = await prisma.patient.findMany({
-    include: {
-      devices: {
-        include: { readings: { orderBy: { timestamp: "desc" }, take: 30 } },
-      },
-    },
+function startPrimary() {
+  const producer = new Producer(prisma);
+  cluster.setupPrimary({ serialization: "advanced" });
+
+  const send = (worker, msg) => {
+    if (worker.isConnected()) worker.send(msg);
+  };
+  const broadcast = (msg) => {
+    for (const worker of Object.values(cluster.workers)) send(worker, msg);
+  };
+  const initMessage = () => ({
+    type: "init",
+    seq: tickSeq,
+    patientsJson: producer.store.patientsJSON(),
+    summaries: { json: producer.summaries.json, etag: producer.summaries.etag },
   });
 
-  return patients.map((p) => ({
-    id: p.id,
-    name: p.name,
-    devices: p.devices.map((d) => ({
-      id: d.id,
-      name: d.name,
-      battery: d.battery ?? 100, // include battery, default to 100 if undefined
-      readings: (d.readings || [])
-        .slice()
-        .reverse()
-        .map((r) => ({
-          time: Math.floor(new Date(r.timestamp).getTime() / 1000),
-          value: r.value,
-        })),
-    })),
-  }));
-}
+  // --- Ticks: serialized once for all workers, acked by each worker. A worker
+  // MAX_PENDING_TICKS behind is skipped; once it catches up it gets a fresh init
+  // (which already holds the skipped ticks) instead of the backlog. ---
+  const links = new Map(); // worker.id -> { sent, acked, stale }
+  let tickSeq = 0;
+
+  producer.on("tick", (changes) => {
+    tickSeq += 1;
+    const msg = { type: "tick", seq: tickSeq, changes: JSON.stringify(changes) };
+    let init = null;
+    for (const worker of Object.values(cluster.workers)) {
+      const link = links.get(worker.id);
+      if (!link || !worker.isConnected()) continue;
+      if (link.sent - link.acked >= MAX_PENDING_TICKS) {
+        link.stale = true;
+      } else if (link.stale) {
+        worker.send(init || (init = initMessage()));
+        link.stale = false;
+      } else {
+        worker.send(msg);
+      }
+      if (!link.stale) link.sent = tickSeq;
+    }
+  });
+  // only the patients that were added (or gained devices), built once for all workers
+  producer.on("resync", (ids) => broadcast({ type: "add", patientsJson: producer.store.patientsJSON(ids) }));
+  // removals and renames: every worker gets a fresh init with the next tick
+  producer.on("reload", () => {
+    for (const link of links.values()) link.stale = true;
+  });
+  producer.on("summaries", (s) => broadcast({ type: "summaries", json: s.json, etag: s.etag }));
+  const statsTimer = setInterval(() => broadcast({ type: "stats", stats: producer.stats() }), 5_000);
+
+  // --- /metrics: a scrape lands on any worker, which asks us for the cluster's
+  // series; we collect a snapshot from every worker and add our own. A worker
+  // that does not answer in time is counted with its last snapshot, so totals
+  // never go backwards between scrapes. ---
+  const scrapes = new Map(); // scrape id -> { worker, id, waiting, timer }
+  const lastSnapshots = new Map(); // worker.id -> registry snapshot
+  let scrapeSeq = 0;
+
+  function finishScrape(scrapeId) {
+    const scrape = scrapes.get(scrapeId);
+    if (!scrape) return;
+    scrapes.delete(scrapeId);
+    clearTimeout(scrape.timer);
+    send(scrape.worker, { type: "metrics", id: scrape.id, snapshots: [registry.snapshot(), ...lastSnapshots.values()] });
+  }
 
+  cluster.on("message", (worker, msg) => {
+    switch (msg && msg.type) {
+      case "ready":
+        links.set(worker.id, { sent: tickSeq, acked: tickSeq, stale: false });
+        send(worker, initMessage());
+        break;
+      case "metrics": {
+        const scrapeId = ++scrapeSeq;
+        const workers = Object.values(cluster.workers).filter((w) => w.isConnected());
+        const timer = setTimeout(() => finishScrape(scrapeId), METRICS_TIMEOUT_MS);
+        scrapes.set(scrapeId, { worker, id: msg.id, waiting: new Set(workers.map((w) => w.id)), timer });
+        for (const w of workers) w.send({ type: "snapshot", id: scrapeId });
+        break;
+      }
+      case "snapshot": {
+        lastSnapshots.set(worker.id, msg.metrics);
+        const scrape = scrapes.get(msg.id);
+        if (!scrape) break;
+        scrape.waiting.delete(worker.id);
+        if (scrape.waiting.size === 0) finishScrape(msg.id);
+        break;
+      }
+      case "tickAck": {
+        const link = links.get(worker.id);
+        if (link) link.acked = msg.seq;
+        break;
+      }
+      case "ingest": // device readings received by a worker
+        producer.ingest(msg.batch).then(
+          (result) => send(worker, { type: "ingestAck", id: msg.id, result }),
+          (err) => send(worker, { type: "ingestAck", id: msg.id, error: err.message })
+        );
+        break;
+    }
+  });
 
-// --- Broadcast helper ---
-async function broadcastPatients() {
-  try {
-    const snapshot = await fetchPatientsWithReadings();
-    const payload = JSON.stringify(snapshot);
+  let stopping = false;
+  cluster.on("exit", (worker, code, signal) => {
+    links.delete(worker.id);
+    lastSnapshots.delete(worker.id); // its counters restart with the new worker
+    if (stopping) return;
+    console.warn(`Worker ${worker.process.pid} exited (${signal || code}), restarting`);
+    cluster.fork();
+  });
 
-    for (const client of clients) {
-      if (client.readyState === client.OPEN) client.send(payload);
+  for (let i = 0; i < WEB_CONCURRENCY; i++) cluster.fork();
+  producer.start();
+  console.log(`Producer ${process.pid} started with ${WEB_CONCURRENCY} web workers`);
+
+  async function shutdown(signal) {
+    console.log(`${signal} received, stopping workers and draining write queue...`);
+    stopping = true;
+    clearInterval(statsTimer);
+    for (const worker of Object.values(cluster.workers)) worker.kill("SIGTERM");
+    try {
+      await producer.stop();
+    } catch (err) {
+      console.error("Write queue drain error:", err);
+    } finally {
+      await prisma.$disconnect();
+      process.exit(0);
     }
-  } catch (err) {
-    console.error("Broadcast error:", err);
   }
+
+  process.once("SIGTERM", () => shutdown("SIGTERM"));
+  process.once("SIGINT", () => shutdown("SIGINT"));
 }
 
-// --- WebSocket connection ---
-wss.on("connection", (ws, req) => {
-  if (!req.url || !req.url.startsWith("/ws/patients")) {
-    ws.close();
-    return;
+function startWeb() {
+  // --- Live state source: our own Producer, or a mirror fed by the primary ---
+  let producer = null;
+  let mirror = null;
+  if (cluster.isWorker) {
+    mirror = new LiveMirror();
+  } else {
+    producer = new Producer(prisma);
+  }
+  const state = producer || mirror;
+  const producerStats = () => (producer ? producer.stats() : mirror.producerStats);
+  const retention = producer ? producer.retention : retentionFromEnv();
+
+  // --- Cluster-wide metrics, rendered by whichever worker is scraped ---
+  const pendingScrapes = new Map(); // id -> resolve
+  let scrapeSeq = 0;
+  const clusterSnapshots = () =>
+    new Promise((resolve) => {
+      const id = ++scrapeSeq;
+      pendingScrapes.set(id, resolve);
+      process.send({ type: "metrics", id });
+    });
+
+  // --- Device ingestion: applied by our Producer, or forwarded to the primary's ---
+  const pendingIngests = new Map(); // id -> { resolve, reject }
+  let ingestSeq = 0;
+  const ingest = producer
+    ? (batch) => producer.ingest(batch)
+    : (batch) =>
+        new Promise((resolve, reject) => {
+          const id = ++ingestSeq;
+          pendingIngests.set(id, { resolve, reject });
+          process.send({ type: "ingest", id, batch });
+        });
+
+  // --- HTTP server + WebSocket ---
+  const server = http.createServer(app);
+  const wss = new WebSocketServer({ server, maxPayload: MAX_INGEST_BYTES });
+
+  // --- WebSocket fan-out (legacy full frames or snapshot + deltas) ---
+  const fanout = new Fanout((patientIds) => state.store.patientsJSON(patientIds));
+
+  function publishTick(changes) {
+    fanout.publishDelta(changes);
+    if (fanout.hasLegacyClients()) fanout.broadcastFull();
+  }
+
+  if (producer) {
+    producer.on("tick", publishTick);
+    producer.on("resync", () => fanout.invalidate());
+    producer.on("reload", () => fanout.invalidate());
+    producer.start();
+  } else {
+    process.on("message", (msg) => {
+      switch (msg && msg.type) {
+        case "init":
+          mirror.load(msg.patientsJson);
+          mirror.summaries.load(msg.summaries);
+          fanout.invalidate();
+          process.send({ type: "tickAck", seq: msg.seq });
+          break;
+        case "add":
+          mirror.add(msg.patientsJson);
+          fanout.invalidate();
+          break;
+        case "tick": {
+          const changes = JSON.parse(msg.changes);
+          mirror.applyTick(changes);
+          publishTick(changes);
+          process.send({ type: "tickAck", seq: msg.seq });
+          break;
+        }
+        case "summaries":
+          mirror.summaries.load(msg);
+          break;
+        case "stats":
+          mirror.producerStats = msg.stats;
+          break;
+        case "snapshot":
+          process.send({ type: "snapshot", id: msg.id, metrics: registry.snapshot() });
+          break;
+        case "metrics": {
+          const resolve = pendingScrapes.get(msg.id);
+          pendingScrapes.delete(msg.id);
+          if (resolve) resolve(msg.snapshots);
+          break;
+        }
+        case "ingestAck": {
+          const pending = pendingIngests.get(msg.id);
+          if (!pending) break;
+          pendingIngests.delete(msg.id);
+          if (msg.error) pending.reject(new Error(msg.error));
+          else pending.resolve(msg.result);
+          break;
+        }
+      }
+    });
+    process.send({ type: "ready" });
   }
 
-  console.log("WS client connected:", req.socket.remoteAddress);
-  clients.add(ws);
+  // --- WebSocket connection ---
+  wss.on("connection", (ws, req) => {
+    if (req.url && req.url.startsWith("/ws/ingest")) {
+      handleIngestSocket(ws, req);
+      return;
+    }
+    if (!req.url || !req.url.startsWith("/ws/patients")) {
+      ws.close();
+      return;
+    }
+
+    console.log("WS client connected:", req.socket.remoteAddress);
+    fanout.add(ws, req);
 
-  ws.on("close", () => {
-    clients.delete(ws);
-    console.log("WS client disconnected");
+    ws.on("close", () => {
+      console.log("WS client disconnected");
+    });
+
+    ws.on("error", (err) => {
+      console.warn("WS error", err);
+    });
   });
 
-  ws.on("error", (err) => {
-    console.warn("WS error", err);
+  // --- Request timings (route label is the matched Express route) ---
+  app.use("/api", (req, res, next) => {
+    const started = process.hrtime.bigint();
+    res.on("finish", () => httpSeconds.observeSince(started, { route: req.route ? req.route.path : "unmatched" }));
+    next();
   });
-});
 
-// --- Simulation tick ---
-async function simulationTick() {
-  try {
-    const devices = await prisma.device.findMany({
-      include: { readings: { orderBy: { timestamp: "desc" }, take: 1 } },
+  // --- Device ingestion over WebSocket: one batch per message (binary records or
+  // JSON), acked in order with {"type":"ack","batch":N,"accepted","rejected"}.
+  // Batches run one at a time; with MAX_INGEST_IN_FLIGHT waiting (e.g. on a full
+  // write queue) the socket stops being read, so TCP pushes back on the sender. ---
+  function handleIngestSocket(ws, req) {
+    console.log("Ingest client connected:", req.socket.remoteAddress);
+    let batchNo = 0;
+    let inFlight = 0;
+    let chain = Promise.resolve();
+
+    ws.on("message", (data, isBinary) => {
+      const n = ++batchNo;
+      if (++inFlight >= MAX_INGEST_IN_FLIGHT) ws.pause();
+      chain = chain.then(async () => {
+        let ack;
+        try {
+          const batch = isBinary ? decodeBinary(data) : decodeJSON(JSON.parse(data.toString()));
+          ack = { type: "ack", batch: n, ...(await ingest(batch)) };
+        } catch (err) {
+          ack = { type: "ack", batch: n, error: err.message };
+        }
+        if (ws.readyState === ws.OPEN) ws.send(JSON.stringify(ack));
+        if (--inFlight < MAX_INGEST_IN_FLIGHT && ws.isPaused) ws.resume();
+      });
     });
 
-    const updates = devices.map(async (d) => {
-      const lastReading = d.readings[0] || null;
+    ws.on("error", (err) => {
+      console.warn("Ingest WS error", err);
+    });
+  }
 
-      // Determine baseline and variation
-      let baseline = 75, variation = 0.5;
-      if (d.name.toLowerCase().includes("heart")) { baseline = 70; variation = 1; }
-      if (d.name.toLowerCase().includes("temperature")) { baseline = 98.6; variation = 0.2; }
+  // --- Device ingestion over HTTP: application/octet-stream (binary records) or JSON ---
+  app.post(
+    "/api/ingest",
+    express.raw({ type: "application/octet-stream", limit: MAX_INGEST_BYTES }),
+    express.json({ limit: MAX_INGEST_BYTES }),
+    async (req, res) => {
+      let batch;
+      try {
+        batch = Buffer.isBuffer(req.body) ? decodeBinary(req.body) : decodeJSON(req.body);
+      } catch (err) {
+        return res.status(400).json({ error: err.message });
+      }
 
-      const prevValue = lastReading ? lastReading.value : baseline;
-      let newValue = prevValue + (baseline - prevValue) * 0.05 + (Math.random() - 0.5) * variation;
+      try {
+        res.json(await ingest(batch));
+      } catch (err) {
+        console.error("POST /api/ingest error:", err);
+        res.status(500).json({ error: "failed" });
+      }
+    }
+  );
 
-      // enforce realistic floors
-      if (d.name.toLowerCase().includes("heart")) newValue = Math.max(50, newValue);
-      if (d.name.toLowerCase().includes("temperature")) newValue = Math.max(95, newValue);
+  app.get("/api/patients", (req, res) => {
+    res.type("json").send(state.store.patientsJSON());
+  });
 
-      let battery = d.battery ?? 100;
-      if (battery <= 0) battery = 100; // reset if drained
-      const now = Date.now();
-      if (!d._lastBatteryRed) d._lastBatteryRed = 0;
-      if (now - d._lastBatteryRed > 60_000) {
-        battery = Math.max(0, battery - 1); // reduce once per minute
-        d._lastBatteryRed = now;
-      }
+  app.get("/api/summaries", (req, res) => state.summaries.handle(req, res));
 
-      // Save new reading (and updated battery if you want)
-      await prisma.$transaction([
-        prisma.reading.create({
-          data: {
-            deviceId: d.id,
-            value: parseFloat(newValue.toFixed(2)),
-          },
-        }),
-        prisma.device.update({
-          where: { id: d.id },
-          data: { battery: parseFloat(battery.toFixed(1)) },
-        }),
-      ]);
-    });
+  // --- History: ?deviceId=1&from=&to=&points= (times in epoch seconds or ISO) ---
+  app.get("/api/history", async (req, res) => {
+    const deviceId = Number(req.query.deviceId);
+    const to = parseTime(req.query.to, Date.now());
+    const from = parseTime(req.query.from, to.getTime() - 60 * 60 * 1000);
+    const maxPoints = Math.min(Math.max(Number(req.query.points) || 500, 1), 5000);
 
-    await Promise.all(updates);
+    if (!Number.isInteger(deviceId) || isNaN(from) || isNaN(to) || from >= to) {
+      return res.status(400).json({ error: "deviceId, from < to required" });
+    }
 
-    // Broadcast updated readings to frontend
-    await broadcastPatients();
-  } catch (err) {
-    console.error("Simulation tick error:", err);
-  }
-}
+    try {
+      res.json(await queryHistory(prisma, { deviceId, from, to, maxPoints }, retention));
+    } catch (err) {
+      console.error("GET /api/history error:", err);
+      res.status(500).json({ error: "failed" });
+    }
+  });
 
+  app.get("/api/stats/rollups", (req, res) => {
+    res.json(producerStats().rollups || {});
+  });
 
+  app.get("/api/stats/ingest", (req, res) => {
+    res.json(producerStats().ingest || {});
+  });
 
+  // fan-out counters are per process (per worker in cluster mode)
+  app.get("/api/stats/fanout", (req, res) => {
+    res.json({ pid: process.pid, ...fanout.stats() });
+  });
 
+  // --- Prometheus metrics: this process, or the whole cluster in cluster mode ---
+  app.get("/metrics", async (req, res) => {
+    const text = mirror ? renderSnapshots(await clusterSnapshots()) : registry.render();
+    res.type("text/plain; version=0.0.4").send(text);
+  });
 
-// Start simulation loop
-setInterval(simulationTick, 1000);
+  // --- SPA fallback (put after all API routes!) ---
+  if (staticFolder) {
+    app.get("*", (req, res) => {
+      res.sendFile(path.join(staticFolder, "index.html"));
+    });
+  }
+  // --- Start server ---
+  server.listen(PORT, "0.0.0.0", () => {
+    const role = cluster.isWorker ? `worker ${process.pid}` : "standalone";
+    console.log(`Server running on http://0.0.0.0:${PORT} (${role})`);
+    console.log(`WebSocket endpoint: ws://0.0.0.0:${PORT}/ws/patients`);
+  });
 
-app.get("/api/patients", async (req, res) => {
-  try {
-    const snapshot = await fetchPatientsWithReadings();
-    res.json(snapshot);
-  } catch (err) {
-    console.error("GET /api/patients error:", err);
-    res.status(500).json({ error: "failed" });
+  // --- Graceful shutdown: stop producing, then drain queued readings ---
+  async function shutdown(signal) {
+    console.log(`${signal} received, shutting down...`);
+    for (const ws of wss.clients) ws.close(1001, "server shutting down");
+    server.close();
+    try {
+      if (producer) await producer.stop();
+    } catch (err) {
+      console.error("Write queue drain error:", err);
+    } finally {
+      await prisma.$disconnect();
+      process.exit(0);
+    }
   }
-});
 
-// --- SPA fallback (put after all API routes!) ---
-if (staticFolder) {
-  app.get("*", (req, res) => {
-    res.sendFile(path.join(staticFolder, "index.html"));
-  });
+  process.once("SIGTERM", () => shutdown("SIGTERM"));
+  process.once("SIGINT", () => shutdown("SIGINT"));
+}
+
+function parseTime(value, fallback) {
+  if (value === undefined || value === "") return new Date(fallback);
+  const n = Number(value);
+  return new Date(Number.isFinite(n) ? n * 1000 : value);
 }
-// --- Start server ---
-server.listen(PORT, "0.0.0.0", () => {
-  console.log(`Server running on http://0.0.0.0:${PORT}`);
-  console.log(`WebSocket endpoint: ws://0.0.0.0:${PORT}/ws/patients`);
-});
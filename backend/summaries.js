@@ -0,0 +1,108 @@
+// backend/summaries.js
+// Latest health summary per patient, rebuilt from the live store on an interval
+// and kept pre-serialized so /api/summaries is a memory read. Responses carry an
+// ETag; a matching If-None-Match gets an empty 304.
+//
+// A summary's lastUpdated is the time its text last changed. Rebuilds that
+// produce the same text leave it (and the ETag) alone, so an unchanged patient
+// keeps an old timestamp while still being re-checked every interval.
+
+const crypto = require("crypto");
+const { KIND_HEART, KIND_TEMPERATURE } = require("./liveStore");
+
+// Versions restart at 1 with every process, so ETags also carry a per-boot id;
+// a tag from a previous process can never match new content.
+const BOOT_ID = Date.now().toString(36) + crypto.randomBytes(4).toString("hex");
+
+// If-None-Match holds "*" or a comma-separated list of (possibly weak) tags;
+// 304 decisions use the weak comparison (RFC 9110 13.1.2).
+function etagMatches(header, etag) {
+  if (!header) return false;
+  if (header.trim() === "*") return true;
+  const opaque = (tag) => tag.trim().replace(/^W\//, "");
+  const target = opaque(etag);
+  return header.split(",").some((tag) => opaque(tag) === target);
+}
+
+// Uses the analytics engine's rolling means when one is attached to the store.
+function summarizePatient(store, patient) {
+  let tempSum = 0, tempCount = 0, hrSum = 0, hrCount = 0;
+  for (const d of patient.devices) {
+    if (store.counts[d.slot] === 0) continue;
+    const value = store.analytics ? store.analytics.mean[d.slot] : store.lastValue(d);
+    if (d.kind === KIND_TEMPERATURE) { tempSum += value; tempCount += 1; }
+    if (d.kind === KIND_HEART) { hrSum += value; hrCount += 1; }
+  }
+  const avgTemp = tempCount ? tempSum / tempCount : null;
+  const avgHR = hrCount ? hrSum / hrCount : null;
+
+  let summary = `${patient.name}: Vitals stable.`;
+  if (avgTemp > 99) summary = `${patient.name}: Temperature slightly elevated.`;
+  if (avgHR > 100) summary = `${patient.name}: Elevated heart rate detected.`;
+
+  return { patientId: patient.id, name: patient.name, summary };
+}
+
+class SummaryCache {
+  constructor(store, { intervalMs = 30_000 } = {}) {
+    this.store = store;
+    this.intervalMs = intervalMs;
+    this.latest = new Map(); // patientId -> { patientId, name, summary, lastUpdated }
+    this.version = 0;
+    this.json = "[]";
+    this.etag = `W/"summaries-${BOOT_ID}-0"`;
+    this.timer = null;
+    this.onChange = null; // called after every new version
+  }
+
+  start() {
+    if (this.timer) return;
+    this.refresh();
+    this.timer = setInterval(() => this.refresh(), this.intervalMs);
+  }
+
+  stop() {
+    if (this.timer) clearInterval(this.timer);
+    this.timer = null;
+  }
+
+  // Rebuild every patient's summary; the version (and ETag) only moves when one changes.
+  refresh(now = Date.now()) {
+    let changed = false;
+    for (const patient of this.store.patients) {
+      const next = summarizePatient(this.store, patient);
+      const prev = this.latest.get(patient.id);
+      if (prev && prev.summary === next.summary) continue;
+      next.lastUpdated = now;
+      this.latest.set(patient.id, next);
+      changed = true;
+    }
+    for (const id of this.latest.keys()) {
+      if (this.store.patientsById.has(id)) continue;
+      this.latest.delete(id); // patient deleted from the DB
+      changed = true;
+    }
+    if (!changed) return;
+
+    this.version += 1;
+    this.json = JSON.stringify([...this.latest.values()]);
+    this.etag = `W/"summaries-${BOOT_ID}-${this.version}"`;
+    if (this.onChange) this.onChange(this);
+  }
+
+  // Adopt a version built elsewhere (web workers mirroring the producer).
+  load({ json, etag }) {
+    this.json = json;
+    this.etag = etag;
+  }
+
+  // Express handler for GET /api/summaries
+  handle(req, res) {
+    res.setHeader("ETag", this.etag);
+    res.setHeader("Cache-Control", "no-cache");
+    if (etagMatches(req.headers["if-none-match"], this.etag)) return res.status(304).end();
+    res.type("json").send(this.json);
+  }
+}
+
+module.exports = { SummaryCache, summarizePatient, etagMatches };
@@ -0,0 +1,127 @@
+// backend/test/ingest.test.js
+// Ingestion batch codec and Producer.ingest validation.
+//   npm test
+
+const test = require("node:test");
+const assert = require("node:assert/strict");
+const { RECORD_BYTES, decodeBinary, decodeJSON, encodeBinary } = require("../ingest");
+const { Producer } = require("../producer");
+
+const nowS = () => Date.now() / 1000;
+
+// A Producer with the simulator off and two devices; the write queue is never
+// started, so the stub Prisma client is never called.
+function makeProducer() {
+  const producer = new Producer({}, { SIMULATE: "0" });
+  const patient = producer.store.addPatient(1, "Alice");
+  producer.store.addDevice(patient, 1, "Heart Rate Sensor", 100);
+  producer.store.addDevice(patient, 2, "Temperature Sensor", 90);
+  return producer;
+}
+
+test("binary records round-trip", () => {
+  const t = nowS();
+  const buf = encodeBinary([
+    { deviceId: 7, timestamp: t, value: 72.25, battery: 55.5 },
+    { deviceId: 4294967295, timestamp: t + 1, value: -1.5 },
+  ]);
+  assert.equal(buf.length, 2 * RECORD_BYTES);
+
+  const batch = decodeBinary(buf);
+  assert.equal(batch.n, 2);
+  assert.deepEqual([...batch.deviceIds], [7, 4294967295]);
+  assert.deepEqual([...batch.times], [t, t + 1]);
+  assert.deepEqual([...batch.values], [72.25, -1.5]);
+  assert.equal(batch.batteries[0], 55.5);
+  assert.ok(Number.isNaN(batch.batteries[1]));
+});
+
+test("binary batches must be whole records", () => {
+  assert.throws(() => decodeBinary(Buffer.alloc(RECORD_BYTES + 1)), /multiple of 24/);
+  assert.equal(decodeBinary(Buffer.alloc(0)).n, 0);
+});
+
+test("JSON records: invalid ids and non-numeric fields decode to rejectable values", () => {
+  const batch = decodeJSON({
+    readings: [
+      { deviceId: 3, timestamp: 10, value: 1, battery: 50 },
+      { device_id: 4, timestamp: 10, value: 2 },
+      { deviceId: 10.7, timestamp: 10, value: 3 },
+      { deviceId: -1, timestamp: 10, value: 4 },
+      { deviceId: "5", timestamp: "10", value: null, battery: "80" },
+      null,
+    ],
+  });
+  assert.deepEqual([...batch.deviceIds], [3, 4, 0, 0, 0, 0]);
+  assert.ok(Number.isNaN(batch.times[4]));
+  assert.ok(Number.isNaN(batch.values[4]));
+  assert.ok(Number.isNaN(batch.batteries[1]));
+  assert.ok(Number.isNaN(batch.batteries[4]));
+
+  assert.throws(() => decodeJSON({}), /expected an array/);
+  assert.equal(decodeJSON([]).n, 0);
+});
+
+test("ingest rejects unknown devices, bad values, future and late timestamps", async () => {
+  const producer = makeProducer();
+  const t = nowS();
+  const lateS = 60; // MAX_LATENESS_S
+  const batch = decodeJSON([
+    { deviceId: 1, timestamp: t, value: 80 }, // ok
+    { deviceId: 2, timestamp: t - lateS + 5, value: 98.6, battery: 42 }, // ok, just inside the lateness bound
+    { deviceId: 99, timestamp: t, value: 80 }, // unknown device
+    { deviceId: 1.5, timestamp: t, value: 80 }, // non-integer id
+    { deviceId: 1, timestamp: t + 3600, value: 80 }, // future
+    { deviceId: 1, timestamp: t - lateS - 5, value: 80 }, // too late
+    { deviceId: 1, timestamp: 1, value: 80 }, // 1970
+    { deviceId: 1, timestamp: t, value: "80" }, // non-numeric value
+  ]);
+  const result = await producer.ingest(batch);
+
+  assert.deepEqual(result, { accepted: 2, rejected: 6 });
+  assert.equal(producer.writeQueue.pending.length, 2);
+  assert.equal(producer.writeQueue.pending[1].battery, 42);
+});
+
+test("ingested points reach the store and the deltas in the same tick, once", async () => {
+  const producer = makeProducer();
+  const device = producer.store.devicesById.get(1);
+  const t = Math.floor(nowS());
+
+  await producer.ingest(decodeJSON([{ deviceId: 1, timestamp: t, value: 81.5, battery: 70 }]));
+  // not visible to snapshots before the tick that broadcasts it
+  assert.equal(producer.store.counts[device.slot], 0);
+  assert.ok(!producer.store.patientsJSON().includes("81.5"));
+
+  const ticks = [];
+  producer.on("tick", (changes) => ticks.push(changes));
+  await producer.simulationTick();
+  await producer.simulationTick();
+
+  assert.equal(ticks.length, 2);
+  assert.deepEqual(ticks[0].map((c) => [c.id, c.points, c.battery]), [[1, [{ time: t, value: 81.5 }], 70]]);
+  assert.deepEqual(ticks[1], []);
+  assert.equal(producer.store.lastValue(device), 81.5);
+  assert.equal(producer.store.battery[device.slot], 70);
+});
+
+test("late points are persisted but kept out of the time-ordered live state", async () => {
+  const producer = makeProducer();
+  const device = producer.store.devicesById.get(1);
+  const t = Math.floor(nowS());
+  const ticks = [];
+  producer.on("tick", (changes) => ticks.push(changes));
+
+  await producer.ingest(decodeJSON([{ deviceId: 1, timestamp: t, value: 3 }]));
+  // out of order within one tick, then one older than what the store holds
+  await producer.ingest(decodeJSON([{ deviceId: 1, timestamp: t + 2, value: 5 }, { deviceId: 1, timestamp: t + 1, value: 4 }]));
+  await producer.simulationTick();
+  await producer.ingest(decodeJSON([{ deviceId: 1, timestamp: t - 30, value: 1 }]));
+  await producer.simulationTick();
+
+  assert.deepEqual(ticks[0][0].points.map((p) => p.value), [3, 4, 5]);
+  assert.deepEqual(ticks[1], []);
+  assert.equal(producer.store.lastValue(device), 5);
+  assert.equal(producer.store.lastTime(device), t + 2);
+  assert.equal(producer.writeQueue.pending.length, 4);
+});
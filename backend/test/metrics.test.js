@@ -0,0 +1,27 @@
+// backend/test/metrics.test.js
+// Summing registry snapshots, as done for /metrics in cluster mode.
+//   npm test
+
+const test = require("node:test");
+const assert = require("node:assert/strict");
+const { Registry, renderSnapshots } = require("../metrics");
+
+function worker(requests, seconds) {
+  const registry = new Registry();
+  registry.counter("frames_total", "Frames").inc(requests);
+  const h = registry.histogram("request_seconds", "Requests", { buckets: [0.1, 1] });
+  for (const s of seconds) h.observe(s, { route: "/api/patients" });
+  return registry.snapshot();
+}
+
+test("snapshots of several workers render as one cluster-wide total", () => {
+  const text = renderSnapshots([worker(2, [0.05]), null, worker(3, [0.5, 5])]);
+  const lines = text.trim().split("\n");
+
+  assert.ok(lines.includes("frames_total 5"));
+  assert.ok(lines.includes('request_seconds_bucket{route="/api/patients",le="0.1"} 1'));
+  assert.ok(lines.includes('request_seconds_bucket{route="/api/patients",le="1"} 2'));
+  assert.ok(lines.includes('request_seconds_bucket{route="/api/patients",le="+Inf"} 3'));
+  assert.ok(lines.includes('request_seconds_count{route="/api/patients"} 3'));
+  assert.equal(lines.filter((l) => l.startsWith("# TYPE frames_total")).length, 1);
+});
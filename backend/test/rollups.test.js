@@ -0,0 +1,69 @@
+// backend/test/rollups.test.js
+// RollupJobs: which minutes a run closes; queryHistory: which source it reads.
+//   npm test
+
+const test = require("node:test");
+const assert = require("node:assert/strict");
+const { RollupJobs, queryHistory } = require("../rollups");
+
+const MINUTE_MS = 60_000;
+const floorTo = (ms, step) => Math.floor(ms / step) * step;
+
+// Records the [from, to) range of each minute rollup statement.
+function stubPrisma() {
+  const db = {
+    ranges: [],
+    $executeRaw: async (strings, ...values) => {
+      const dates = values.filter((v) => v instanceof Date).map((d) => d.getTime());
+      db.ranges.push(dates);
+      return 0;
+    },
+  };
+  return db;
+}
+
+test("minutes are closed up to the lag, but not past readings still queued", async () => {
+  const db = stubPrisma();
+  let pending = null;
+  const jobs = new RollupJobs(db, { maxMinutesPerRun: 1_000, pendingSince: () => pending });
+  const lagged = floorTo(Date.now() - jobs.lagMs, MINUTE_MS);
+  jobs.minuteMark = lagged - 30 * MINUTE_MS;
+
+  pending = lagged - 10 * MINUTE_MS + 5_000; // queued reading 10 min behind the lag
+  await jobs.rollupMinutes();
+  assert.equal(jobs.minuteMark, lagged - 10 * MINUTE_MS);
+  await jobs.rollupMinutes(); // still queued: nothing to do
+  assert.equal(db.ranges.length, 1);
+
+  pending = null; // flushed
+  await jobs.rollupMinutes();
+  assert.equal(jobs.minuteMark, lagged);
+  assert.deepEqual(db.ranges[1], [lagged - 10 * MINUTE_MS, lagged]);
+});
+
+test("raw history falls back to minute buckets instead of truncating busy devices", async () => {
+  const retention = { rawRetentionDays: 7, minuteRetentionDays: 90 };
+  const to = new Date();
+  const from = new Date(to.getTime() - 100_000); // 100 s: raw at 1 Hz
+  const raw = (n) => Array.from({ length: n }, (_, i) => ({ timestamp: new Date(from.getTime() + i * 400), value: i }));
+  const history = async (rows) => {
+    const queries = [];
+    const prisma = {
+      $queryRaw: async (strings, ...values) => {
+        queries.push(strings.join("?") + values.map((v) => v?.sql ?? "").join(" "));
+        return queries.length === 1 ? rows : [{ t: 60, avg: 1, min: 0, max: 2, count: 150 }];
+      },
+    };
+    return { result: await queryHistory(prisma, { deviceId: 1, from, to, maxPoints: 100 }, retention), queries };
+  };
+
+  const fits = await history(raw(100));
+  assert.equal(fits.result.resolution, "raw");
+  assert.equal(fits.result.points.length, 100);
+  assert.equal(fits.queries.length, 1);
+
+  const busy = await history(raw(101)); // 2.5 Hz: the LIMIT would cut off the newest 60 s
+  assert.equal(busy.result.resolution, "1m");
+  assert.equal(busy.result.bucketSeconds, 60);
+  assert.match(busy.queries[1], /ReadingRollup1m/);
+});
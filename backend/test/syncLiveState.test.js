@@ -0,0 +1,84 @@
+// backend/test/syncLiveState.test.js
+// Producer.syncLiveState against a stub Prisma client: additions, renames and
+// deletions in the Patient/Device tables reach the live store.
+//   npm test
+
+const test = require("node:test");
+const assert = require("node:assert/strict");
+const { Producer } = require("../producer");
+
+// `patients` is the Patient/Device table content; readingQueries records the
+// device ids each latest-readings query asked for.
+function stubPrisma(patients) {
+  const db = {
+    patients,
+    readingQueries: [],
+    patient: { findMany: async () => structuredClone(db.patients) },
+    $queryRaw: async (strings, ...values) => {
+      const ids = values.find(Array.isArray);
+      db.readingQueries.push(ids);
+      return ids.map((deviceId) => ({ deviceId, timestamp: new Date(1_700_000_000_000), value: deviceId * 10 }));
+    },
+  };
+  return db;
+}
+
+const device = (id, name = "Heart Rate Sensor") => ({ id, name, battery: 90 });
+
+test("sync adds new rows, renames changed ones and removes deleted ones", async () => {
+  const db = stubPrisma([
+    { id: 1, name: "Alice", devices: [device(1), device(2, "Temperature Sensor")] },
+    { id: 2, name: "Bob", devices: [device(3)] },
+  ]);
+  const producer = new Producer(db, { SIMULATE: "0" });
+  const events = [];
+  producer.on("resync", (ids) => events.push(["resync", [...ids]]));
+  producer.on("reload", () => events.push(["reload"]));
+  const { store } = producer;
+
+  await producer.syncLiveState();
+  producer.summaries.refresh();
+  assert.deepEqual(db.readingQueries, [[1, 2, 3]]);
+  assert.equal(store.lastValue(store.devicesById.get(3)), 30);
+
+  // nothing changed: no readings query, no event
+  await producer.syncLiveState();
+  assert.equal(db.readingQueries.length, 1);
+
+  db.patients[1].devices.push(device(4));
+  await producer.syncLiveState();
+  assert.deepEqual(db.readingQueries[1], [4]);
+  assert.deepEqual(events, [["resync", [1, 2]], ["resync", [2]]]);
+
+  // Alice loses a device and is renamed, Bob is deleted
+  db.patients = [{ id: 1, name: "Alice B.", devices: [device(2, "Heart Rate Sensor")] }];
+  await producer.syncLiveState();
+  assert.equal(db.readingQueries.length, 2);
+  assert.deepEqual(events.at(-1), ["reload"]);
+  assert.deepEqual([...store.devicesById.keys()], [2]);
+  assert.deepEqual(store.patients.map((p) => p.name), ["Alice B."]);
+  const renamed = store.devicesById.get(2);
+  assert.equal(renamed.name, "Heart Rate Sensor");
+  assert.equal(producer.analytics.kinds[renamed.slot], renamed.kind);
+
+  const json = JSON.parse(store.patientsJSON());
+  assert.deepEqual(json.map((p) => p.devices.map((d) => d.id)), [[2]]);
+  producer.summaries.refresh();
+  assert.deepEqual(JSON.parse(producer.summaries.json).map((s) => s.patientId), [1]);
+});
+
+test("removed devices are no longer simulated and their pending points are dropped", async () => {
+  const db = stubPrisma([{ id: 1, name: "Alice", devices: [device(1), device(2)] }]);
+  const producer = new Producer(db, {});
+  producer.writeQueue.enqueue = async () => {}; // nothing is persisted here
+  await producer.syncLiveState();
+
+  producer.pendingChanges.set(2, { id: 2, patientId: 1, points: [{ time: 1, value: 1 }] });
+  db.patients[0].devices = [device(1)];
+  await producer.syncLiveState();
+
+  const ticks = [];
+  producer.on("tick", (changes) => ticks.push(changes));
+  await producer.simulationTick();
+  assert.deepEqual(ticks[0].map((c) => c.id), [1]);
+});
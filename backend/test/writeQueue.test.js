@@ -0,0 +1,166 @@
+// backend/test/writeQueue.test.js
+// WriteBehindQueue retries, rejected rows, backpressure and drain, against an
+// in-memory stand-in for the Prisma calls it makes.
+//   npm test
+
+const test = require("node:test");
+const assert = require("node:assert/strict");
+const { WriteBehindQueue } = require("../writeQueue");
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+const knownError = (code, message) => Object.assign(new Error(message), { code });
+
+// `devices` are the ids that exist. Set `down` to fail that many transactions
+// (Infinity: until reset) with a connection error; a reading with value -1
+// violates a unique constraint. Transactions are all-or-nothing.
+function stubPrisma(devices = [1, 2, 3]) {
+  const db = {
+    devices: new Set(devices),
+    readings: [],
+    batteries: new Map(),
+    down: 0,
+    transactions: 0,
+    reading: {
+      createMany: ({ data }) => () => {
+        for (const r of data) {
+          if (!db.devices.has(r.deviceId)) throw knownError("P2003", "Foreign key constraint violated: Reading_deviceId_fkey");
+          if (r.value === -1) throw knownError("P2002", "Unique constraint failed");
+        }
+        return () => {
+          for (const r of data) db.readings.push(r);
+        };
+      },
+    },
+    device: {
+      update: ({ where, data }) => () => {
+        if (!db.devices.has(where.id)) throw knownError("P2025", "Record to update not found");
+        return () => db.batteries.set(where.id, data.battery);
+      },
+      findMany: async ({ where }) => where.id.in.filter((id) => db.devices.has(id)).map((id) => ({ id })),
+    },
+    $transaction: async (ops) => {
+      db.transactions += 1;
+      if (db.down > 0) {
+        db.down -= 1;
+        throw new Error("Can't reach database server");
+      }
+      for (const apply of ops.map((op) => op())) apply();
+    },
+  };
+  return db;
+}
+
+const readings = (n, deviceId = 1) =>
+  Array.from({ length: n }, (_, i) => ({ deviceId, value: i, battery: 90, timestamp: new Date(i * 1000) }));
+
+test("failed flushes keep their rows and back off", async () => {
+  const db = stubPrisma();
+  const queue = new WriteBehindQueue(db, { flushMs: 20 });
+  db.down = 2;
+  await queue.enqueue(readings(5));
+
+  await queue.flush();
+  assert.equal(queue.pending.length, 5);
+  assert.equal(queue.oldestPending(), 0); // holds back the rollups
+  await queue.flush(); // still backing off: no new attempt
+  assert.equal(db.transactions, 1);
+
+  await sleep(25);
+  await queue.flush(); // second failure doubles the backoff
+  assert.equal(db.transactions, 2);
+  assert.ok(queue.retryAt - Date.now() > 20);
+
+  await sleep(45);
+  await queue.flush();
+  assert.deepEqual(db.readings.map((r) => r.value), [0, 1, 2, 3, 4]);
+  assert.equal(queue.stats().flushErrors, 2);
+  assert.equal(queue.stats().droppedRows, 0);
+  assert.equal(queue.retries, 0);
+  assert.equal(queue.oldestPending(), null);
+});
+
+test("rows of a deleted device are dropped and the other devices keep flushing", async () => {
+  const db = stubPrisma([1, 2, 3]);
+  const queue = new WriteBehindQueue(db);
+  db.devices.delete(2);
+  await queue.enqueue([...readings(3, 1), ...readings(4, 2), ...readings(3, 3)]);
+
+  await queue.flush();
+  assert.equal(db.readings.length, 6);
+  assert.ok(db.readings.every((r) => r.deviceId !== 2));
+  assert.deepEqual([...db.batteries.keys()], [1, 3]);
+  const stats = queue.stats();
+  assert.equal(stats.droppedRows, 4);
+  assert.equal(stats.flushErrors, 0);
+  assert.equal(stats.depth, 0);
+
+  await queue.enqueue(readings(2, 3));
+  await queue.flush();
+  assert.equal(db.readings.length, 8);
+});
+
+test("other rejected rows are isolated by bisecting the batch", async () => {
+  const db = stubPrisma();
+  const queue = new WriteBehindQueue(db);
+  const rows = readings(9);
+  rows[6].value = -1;
+  await queue.enqueue(rows);
+
+  await queue.flush();
+  assert.deepEqual(db.readings.map((r) => r.value), [0, 1, 2, 3, 4, 5, 7, 8]);
+  assert.equal(queue.stats().droppedRows, 1);
+  assert.equal(queue.stats().flushedRows, 8);
+});
+
+test("a large failed batch goes back to the queue in order", async () => {
+  const db = stubPrisma();
+  const queue = new WriteBehindQueue(db, { maxDepth: 300_000, batchSize: 200_000 });
+  db.down = Infinity;
+  await queue.enqueue(readings(250_000));
+  await queue.flush();
+
+  assert.equal(queue.pending.length, 250_000);
+  assert.equal(queue.pending[0].value, 0);
+  assert.equal(queue.pending[249_999].value, 249_999);
+});
+
+test("enqueue waits on a full queue until the writer frees space", async () => {
+  const db = stubPrisma();
+  const queue = new WriteBehindQueue(db, { maxDepth: 4, batchSize: 4, flushMs: 10 });
+  db.down = 1;
+
+  let done = false;
+  const enqueued = queue.enqueue(readings(6)).then(() => (done = true));
+  await sleep(5);
+  assert.equal(done, false);
+  assert.equal(queue.pending.length, 4);
+  assert.ok(queue.stats().backpressureWaits >= 1);
+
+  await sleep(10);
+  await queue.flush(); // the database is back
+  await enqueued;
+  await queue.drain();
+  assert.deepEqual(db.readings.map((r) => r.value), [0, 1, 2, 3, 4, 5]);
+  assert.equal(queue.stats().droppedRows, 0);
+});
+
+test("drain keeps retrying and drops rows only after maxRetries", async () => {
+  const recovering = stubPrisma();
+  const queue = new WriteBehindQueue(recovering, { flushMs: 5, maxRetries: 3 });
+  recovering.down = 2;
+  await queue.enqueue(readings(3));
+  await queue.drain();
+  assert.equal(recovering.readings.length, 3);
+  assert.equal(queue.stats().droppedRows, 0);
+  await assert.rejects(queue.enqueue(readings(1)), /closed/);
+
+  const down = stubPrisma();
+  const stuck = new WriteBehindQueue(down, { flushMs: 5, maxRetries: 2 });
+  down.down = Infinity;
+  await stuck.enqueue(readings(3));
+  await stuck.drain();
+  assert.equal(down.transactions, 3);
+  assert.equal(stuck.stats().droppedRows, 3);
+  assert.equal(stuck.stats().depth, 0);
+});
@@ -0,0 +1,269 @@
+// backend/writeQueue.js
+// Write-behind stage for readings: producers enqueue, a single writer flushes
+// batches to the database either when enough rows are pending or on a timer.
+// Flushes that fail on the connection keep their rows and back off; while the
+// database is down the queue fills up to maxDepth and the depth limit throttles
+// producers. Rows the database rejects (their device was deleted, a duplicate)
+// would fail every retry, so they are dropped and the rest of the batch is
+// written. Otherwise rows are only dropped at shutdown, after maxRetries more
+// attempts.
+
+const { registry } = require("./metrics");
+
+// Prisma request errors that are not caused by the rows themselves: pool
+// timeout and transaction conflicts are worth retrying like connection errors.
+const TRANSIENT_CODES = new Set(["P2024", "P2034"]);
+
+// A known request error (P2xxx: foreign key, unique constraint, record not
+// found, ...) fails the same way however often the batch is retried.
+function isRowError(err) {
+  return typeof err?.code === "string" && err.code.startsWith("P2") && !TRANSIENT_CODES.has(err.code);
+}
+
+class WriteBehindQueue {
+  constructor(
+    prisma,
+    { maxDepth = 50_000, batchSize = 1_000, flushMs = 1_000, maxRetries = 3, maxBackoffMs = 30_000 } = {}
+  ) {
+    this.prisma = prisma;
+    this.maxDepth = maxDepth;
+    this.batchSize = batchSize;
+    this.flushMs = flushMs;
+    this.maxRetries = maxRetries; // flush attempts at shutdown before giving up
+    this.maxBackoffMs = maxBackoffMs;
+
+    this.pending = [];
+    this.waiters = []; // producers blocked on a full queue
+    this.flushing = null; // in-flight flush promise (single writer)
+    this.writing = []; // rows of the in-flight batch
+    this.retries = 0; // consecutive failed flushes
+    this.retryAt = 0; // no flush before this time while backing off
+    this.persistedBattery = new Map(); // deviceId -> last battery written
+    this.timer = null;
+    this.closed = false;
+
+    this.counters = {
+      enqueued: 0,
+      flushedRows: 0,
+      flushes: 0,
+      flushErrors: 0,
+      droppedRows: 0,
+      backpressureWaits: 0,
+      lastBatchSize: 0,
+      maxBatchSize: 0,
+      lastFlushMs: 0,
+      maxFlushMs: 0,
+      totalFlushMs: 0,
+    };
+
+    const c = this.counters;
+    this.commitSeconds = registry.histogram("iot_db_commit_seconds", "Write queue flush transaction (bulk insert + battery updates)");
+    registry.gauge("iot_write_queue_depth", "Readings waiting to be flushed", { collect: () => this.pending.length });
+    registry.counter("iot_db_rows_written_total", "Readings inserted by the write queue", { collect: () => c.flushedRows });
+    registry.counter("iot_db_commit_errors_total", "Failed write queue flushes", { collect: () => c.flushErrors });
+    registry.counter("iot_db_rows_dropped_total", "Readings rejected by the database or not persisted at shutdown", { collect: () => c.droppedRows });
+    registry.counter("iot_write_queue_backpressure_total", "Times a producer waited on a full write queue", { collect: () => c.backpressureWaits });
+  }
+
+  start() {
+    if (this.timer) return;
+    this.timer = setInterval(() => this.flush(), this.flushMs);
+  }
+
+  // Queue readings ({ deviceId, value, timestamp, battery }). Resolves once every
+  // reading is accepted; waits for the writer to free space when the queue is full.
+  async enqueue(readings) {
+    if (this.closed) throw new Error("write queue is closed");
+
+    for (const reading of readings) {
+      while (this.pending.length >= this.maxDepth) {
+        this.counters.backpressureWaits += 1;
+        this.flush();
+        await new Promise((resolve) => this.waiters.push(resolve));
+      }
+      this.pending.push(reading);
+      this.counters.enqueued += 1;
+    }
+
+    if (this.pending.length >= this.batchSize) this.flush();
+  }
+
+  // Start a flush unless one is already running; returns the in-flight promise.
+  flush() {
+    if (!this.closed && Date.now() < this.retryAt) return this.flushing || Promise.resolve();
+    if (!this.flushing) {
+      this.flushing = this._flushLoop().finally(() => {
+        this.flushing = null;
+      });
+    }
+    return this.flushing;
+  }
+
+  async _flushLoop() {
+    while (this.pending.length > 0) {
+      const ok = await this._flushBatch();
+      if (!ok) break; // leave retries to the next timer tick
+    }
+  }
+
+  async _flushBatch() {
+    const batch = this.pending.splice(0, this.batchSize);
+    this._wakeProducers();
+
+    const started = process.hrtime.bigint();
+    let written;
+    this.writing = batch;
+    try {
+      written = await this._writeBatch(batch);
+    } catch (err) {
+      this.counters.flushErrors += 1;
+      this.retries += 1;
+      const backoffMs = Math.min(this.maxBackoffMs, this.flushMs * 2 ** (this.retries - 1));
+      this.retryAt = Date.now() + backoffMs;
+      console.error(`Write queue flush failed (${this.retries} in a row), retrying in ${backoffMs} ms:`, err);
+      return false;
+    } finally {
+      this.writing = [];
+    }
+
+    const elapsedMs = Number(process.hrtime.bigint() - started) / 1e6;
+    this.commitSeconds.observe(elapsedMs / 1000);
+    this.retries = 0;
+    this.retryAt = 0;
+
+    const c = this.counters;
+    c.flushes += 1;
+    c.flushedRows += written;
+    c.lastBatchSize = written;
+    c.maxBatchSize = Math.max(c.maxBatchSize, written);
+    c.lastFlushMs = elapsedMs;
+    c.maxFlushMs = Math.max(c.maxFlushMs, elapsedMs);
+    c.totalFlushMs += elapsedMs;
+    return true;
+  }
+
+  // Write a batch and return the number of rows written. When the database
+  // rejects rows, rows of devices that no longer exist are dropped, and any
+  // other offending rows are isolated by bisecting the batch and dropped.
+  // On any other error the rows not yet written go back to the front of the
+  // queue and the error is rethrown.
+  async _writeBatch(batch) {
+    const chunks = [batch]; // stack, next chunk last
+    let written = 0;
+    let filtered = false;
+    while (chunks.length > 0) {
+      const rows = chunks.pop();
+      if (rows.length === 0) continue;
+      try {
+        try {
+          await this._write(rows);
+          written += rows.length;
+        } catch (err) {
+          if (!isRowError(err)) throw err;
+          const kept = filtered ? rows : await this._withoutDeletedDevices(rows);
+          filtered = true;
+          if (kept.length < rows.length) {
+            chunks.push(kept);
+          } else if (rows.length > 1) {
+            const mid = rows.length >> 1;
+            chunks.push(rows.slice(mid), rows.slice(0, mid));
+          } else {
+            console.error(`Write queue: dropping a reading for device ${rows[0].deviceId} (${err.code}):`, err.message);
+            this.counters.droppedRows += 1;
+          }
+        }
+      } catch (err) {
+        this.counters.flushedRows += written;
+        this.pending = rows.concat(...chunks.reverse(), this.pending);
+        throw err;
+      }
+    }
+    return written;
+  }
+
+  // Readings and battery updates of one batch, in one transaction.
+  async _write(rows) {
+    // only the latest battery per device matters, and only when it changed
+    const batteries = new Map();
+    for (const r of rows) {
+      if (r.battery === undefined) continue;
+      if (this.persistedBattery.get(r.deviceId) !== r.battery) batteries.set(r.deviceId, r.battery);
+    }
+
+    await this.prisma.$transaction([
+      this.prisma.reading.createMany({
+        data: rows.map((r) => ({ deviceId: r.deviceId, value: r.value, timestamp: r.timestamp })),
+      }),
+      ...[...batteries].map(([id, battery]) =>
+        this.prisma.device.update({ where: { id }, data: { battery } })
+      ),
+    ]);
+    for (const [id, battery] of batteries) this.persistedBattery.set(id, battery);
+  }
+
+  // Drop (and count) the rows of devices deleted from the database.
+  async _withoutDeletedDevices(rows) {
+    const ids = [...new Set(rows.map((r) => r.deviceId))];
+    const found = await this.prisma.device.findMany({ where: { id: { in: ids } }, select: { id: true } });
+    const existing = new Set(found.map((d) => d.id));
+    const kept = rows.filter((r) => existing.has(r.deviceId));
+    if (kept.length < rows.length) {
+      const deleted = ids.filter((id) => !existing.has(id));
+      for (const id of deleted) this.persistedBattery.delete(id);
+      console.error(`Write queue: dropping ${rows.length - kept.length} readings of deleted devices ${deleted.join(", ")}`);
+      this.counters.droppedRows += rows.length - kept.length;
+    }
+    return kept;
+  }
+
+  // Time (ms) of the oldest reading not written yet, or null when there is none.
+  oldestPending() {
+    let oldest = Infinity;
+    for (const rows of [this.writing, this.pending]) {
+      for (const r of rows) if (r.timestamp < oldest) oldest = r.timestamp.getTime();
+    }
+    return oldest === Infinity ? null : oldest;
+  }
+
+  _wakeProducers() {
+    const waiters = this.waiters;
+    this.waiters = [];
+    for (const resolve of waiters) resolve();
+  }
+
+  // Stop accepting readings and flush everything still queued.
+  async drain() {
+    this.closed = true;
+    if (this.timer) clearInterval(this.timer);
+    this.timer = null;
+
+    let attempts = 0;
+    while (this.pending.length > 0 || this.flushing) {
+      const failuresBefore = this.counters.flushErrors;
+      await this.flush();
+      if (this.counters.flushErrors === failuresBefore) continue;
+      if (++attempts > this.maxRetries) {
+        console.error(`Write queue: ${this.pending.length} readings not persisted at shutdown`);
+        this.counters.droppedRows += this.pending.length;
+        this.pending = [];
+      } else {
+        await new Promise((resolve) => setTimeout(resolve, this.flushMs));
+      }
+    }
+    this._wakeProducers();
+  }
+
+  stats() {
+    const c = this.counters;
+    return {
+      depth: this.pending.length,
+      maxDepth: this.maxDepth,
+      batchSize: this.batchSize,
+      flushMs: this.flushMs,
+      ...c,
+      avgFlushMs: c.flushes ? c.totalFlushMs / c.flushes : 0,
+    };
+  }
+}
+
+module.exports = { WriteBehindQueue };
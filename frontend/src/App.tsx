@@ -4,6 +4,9 @@ import Chart from "chart.js/auto";
 
 type Reading = { time: string; value: number };
 
+// rolling window statistics computed by the backend analytics engine
+type DeviceStats = { ewma: number; mean: number; min: number; max: number; z: number; rate: number };
+
 type Device = {
   id?: number;
   name: string;
@@ -11,6 +14,7 @@ type Device = {
   heartRate?: number;
   battery: number;
   alertLevel?: "green" | "yellow" | "red";
+  stats?: DeviceStats | null;
   readings: Reading[];
 };
 
@@ -24,6 +28,94 @@ const MAX_POINTS = 50;
 const REDRAW_MS = 50;
 const backendHost = import.meta.env.VITE_BACKEND_URL;
 
+// normalize a backend reading ({ time: epoch seconds, value }) for the charts
+function mapReading(r: any): Reading {
+  if (r == null) return { time: new Date().toLocaleTimeString(), value: 0 };
+  if (typeof r === "number") return { time: new Date().toLocaleTimeString(), value: r };
+  if (typeof r === "object") {
+    const value = typeof r.value === "number" ? r.value : Number(r.value ?? r) || 0;
+    let timeStr = new Date().toLocaleTimeString();
+    if (r.time) {
+      if (typeof r.time === "number") timeStr = new Date(r.time * 1000).toLocaleTimeString();
+      else timeStr = String(r.time);
+    }
+    return { time: timeStr, value };
+  }
+  return { time: new Date().toLocaleTimeString(), value: Number(r) || 0 };
+}
+
+function mapDevice(d: any): Device {
+  const rawReadings = d.readings ?? [];
+  const readings: Reading[] = rawReadings.map((r: any) => {
+    try {
+      return mapReading(r);
+    } catch {
+      return { time: new Date().toLocaleTimeString(), value: 0 };
+    }
+  });
+
+  // infer latest sensor numeric value from readings
+  const latestReading = rawReadings.length ? rawReadings[rawReadings.length - 1] : null;
+  const latestValue = latestReading ? (typeof latestReading === "object" ? Number(latestReading.value ?? 0) : Number(latestReading)) : 0;
+
+  // decide where latestValue should live: temperature or heartRate
+  let inferredTemp: number | undefined = undefined;
+  let inferredHR: number | undefined = undefined;
+  const name = String(d.name ?? "").toLowerCase();
+  if (name.includes("temp")) inferredTemp = latestValue;
+  if (name.includes("heart")) inferredHR = latestValue;
+
+  return {
+    id: d.id,
+    name: d.name,
+    // prefer explicit fields if backend provided them; otherwise use inferred value
+    temperature: typeof d.temperature === "number" ? d.temperature : inferredTemp,
+    heartRate: typeof d.heartRate === "number" ? d.heartRate : inferredHR,
+    battery: typeof d.battery === "number" ? d.battery : 0,
+    alertLevel: d.alertLevel ?? "green",
+    stats: d.stats ?? null,
+    readings: readings.slice(-MAX_POINTS),
+  } as Device;
+}
+
+function mapPatients(incoming: any[]): Patient[] {
+  return incoming.map((p: any) => ({
+    id: p.id,
+    name: p.name,
+    devices: (p.devices ?? []).map(mapDevice),
+  }) as Patient);
+}
+
+// apply a delta frame ({ id, points, stats, battery?, alertLevel? } per device) to the current patients
+function applyDelta(patients: Patient[], changes: any[]): Patient[] {
+  const byId = new Map<number, any>(changes.map((c) => [c.id, c]));
+
+  return patients.map((p) => {
+    if (!p.devices.some((d) => d.id !== undefined && byId.has(d.id))) return p;
+
+    const devices = p.devices.map((d) => {
+      const change = d.id !== undefined ? byId.get(d.id) : undefined;
+      if (!change) return d;
+
+      const points: Reading[] = (change.points ?? []).map(mapReading);
+      const latest = points.length ? points[points.length - 1].value : undefined;
+      const name = d.name.toLowerCase();
+
+      return {
+        ...d,
+        battery: typeof change.battery === "number" ? change.battery : d.battery,
+        alertLevel: change.alertLevel ?? d.alertLevel,
+        stats: change.stats ?? d.stats,
+        temperature: latest !== undefined && name.includes("temp") ? latest : d.temperature,
+        heartRate: latest !== undefined && name.includes("heart") ? latest : d.heartRate,
+        readings: [...d.readings, ...points].slice(-MAX_POINTS),
+      } as Device;
+    });
+
+    return { ...p, devices };
+  });
+}
+
 
 export default function App(){
   const [patients, setPatients] = useState<Patient[]>([]);
@@ -32,35 +124,30 @@ export default function App(){
     }>({});
     const [summaryHighlights, setSummaryHighlights] = useState<{ [patientId: string]: boolean }>({});
     
-  const patientsRef = useRef<Patient[]>([]);
   const wsRef = useRef<WebSocket | null>(null);
   const chartRefs = useRef<Record<string, Chart | null>>({});
   const [lastUpdated, setLastUpdated] = useState<string>("—");
   
-  // keep ref synced
-  useEffect(() => {
-    patientsRef.current = patients;
-  }, [patients]);
-
-  // helper functions (same as before)
+  // per-patient figures from the backend's rolling device stats (no recomputation here)
   function computePatientAnalytics(patient: Patient) {
-    const temps = patient.devices
-      .filter((d) => typeof d.temperature === "number")
-      .map((d) => d.temperature as number);
-
-    const hrs = patient.devices
-      .filter((d) => typeof d.heartRate === "number")
-      .map((d) => d.heartRate as number);
-
-    const avg = (arr: number[]) => (arr.length ? arr.reduce((a, b) => a + b, 0) / arr.length : NaN);
-    const min = (arr: number[]) => (arr.length ? Math.min(...arr) : NaN);
-    const max = (arr: number[]) => (arr.length ? Math.max(...arr) : NaN);
+    const statsFor = (kind: string) =>
+      patient.devices
+        .filter((d) => d.stats && d.name.toLowerCase().includes(kind))
+        .map((d) => d.stats as DeviceStats);
+
+    const temps = statsFor("temp");
+    const hrs = statsFor("heart");
+    // aggregate across all of the patient's devices of a kind
+    const mean = (stats: DeviceStats[]) =>
+      stats.length ? stats.reduce((sum, s) => sum + s.mean, 0) / stats.length : NaN;
+    const min = (stats: DeviceStats[]) => (stats.length ? Math.min(...stats.map((s) => s.min)) : NaN);
+    const max = (stats: DeviceStats[]) => (stats.length ? Math.max(...stats.map((s) => s.max)) : NaN);
 
     return {
-      avgTemp: avg(temps),
+      avgTemp: mean(temps),
       minTemp: min(temps),
       maxTemp: max(temps),
-      avgHR: avg(hrs),
+      avgHR: mean(hrs),
       minHR: min(hrs),
       maxHR: max(hrs),
       deviceCount: patient.devices.length,
@@ -92,22 +179,6 @@ export default function App(){
   };
 
 
-  useEffect(() => {
-    let temps: number[] = [];
-    let hrs: number[] = [];
-    let deviceCount = 0;
-
-    patients.forEach((p) => {
-      p.devices.forEach((d) => {
-        deviceCount += 1;
-        if (typeof d.temperature === "number") temps.push(d.temperature);
-        if (typeof d.heartRate === "number") hrs.push(d.heartRate);
-      });
-    });
-  }, [patients]);
-
-
-
   useEffect(() => {
     // dynamic ws url:
     location.hostname === "127.0.0.1";
@@ -122,7 +193,9 @@ export default function App(){
     const MAX_RECONNECT_DELAY = 30_000; // 30s
 
     const connect = () => {
-      ws = new WebSocket(WS_URL);
+      const url = new URL(WS_URL);
+      url.searchParams.set("mode", "delta");
+      ws = new WebSocket(url.toString());
       wsRef.current = ws;
 
       ws.onopen = () => {
@@ -145,65 +218,13 @@ export default function App(){
 
       ws.onmessage = (ev) => {
         try {
-          const incoming = JSON.parse(ev.data); // expected: Patient[]
-          if (!Array.isArray(incoming)) return;
-
-          // inside ws.onmessage: replace the device mapping with this
-          const mapped: Patient[] = incoming.map((p: any) => {
-            const devices: Device[] = (p.devices ?? []).map((d: any) => {
-              const rawReadings = d.readings ?? [];
-
-              // normalize readings (same as you already do)
-              const readings: Reading[] = rawReadings.map((r: any) => {
-                try {
-                  if (r == null) return { time: new Date().toLocaleTimeString(), value: 0 };
-                  if (typeof r === "number") return { time: new Date().toLocaleTimeString(), value: r };
-                  if (typeof r === "object") {
-                    const value = typeof r.value === "number" ? r.value : Number(r.value ?? r) || 0;
-                    let timeStr = new Date().toLocaleTimeString();
-                    if (r.time) {
-                      if (typeof r.time === "number") timeStr = new Date(r.time * 1000).toLocaleTimeString();
-                      else timeStr = String(r.time);
-                    }
-                    return { time: timeStr, value };
-                  }
-                  return { time: new Date().toLocaleTimeString(), value: Number(r) || 0 };
-                } catch {
-                  return { time: new Date().toLocaleTimeString(), value: 0 };
-                }
-              });
-
-              // ---- NEW: infer latest sensor numeric value from readings ----
-              const latestReading = rawReadings.length ? rawReadings[rawReadings.length - 1] : null;
-              const latestValue = latestReading ? (typeof latestReading === "object" ? Number(latestReading.value ?? 0) : Number(latestReading)) : 0;
-
-              // decide where latestValue should live: temperature or heartRate
-              let inferredTemp: number | undefined = undefined;
-              let inferredHR: number | undefined = undefined;
-              const name = String(d.name ?? "").toLowerCase();
-              if (name.includes("temp")) inferredTemp = latestValue;
-              if (name.includes("heart")) inferredHR = latestValue;
-
-              return {
-                id: d.id,
-                name: d.name,
-                // prefer explicit fields if backend provided them; otherwise use inferred value
-                temperature: typeof d.temperature === "number" ? d.temperature : inferredTemp,
-                heartRate: typeof d.heartRate === "number" ? d.heartRate : inferredHR,
-                battery: typeof d.battery === "number" ? d.battery : 0,
-                alertLevel: d.alertLevel ?? "green",
-                readings: readings.slice(-MAX_POINTS),
-              } as Device;
-            });
+          // delta mode: a snapshot on connect, then per-device deltas
+          const msg = JSON.parse(ev.data);
+          if (Array.isArray(msg)) setPatients(mapPatients(msg));
+          else if (msg?.type === "snapshot") setPatients(mapPatients(msg.patients ?? []));
+          else if (msg?.type === "delta") setPatients((prev) => applyDelta(prev, msg.devices ?? []));
+          else return;
 
-            return {
-              id: p.id,
-              name: p.name,
-              devices,
-            } as Patient;
-          });
-
-          setPatients(mapped);
           setLastUpdated(new Date().toLocaleTimeString());
         } catch (err) {
           console.error("Failed to parse WS message", err);
@@ -217,51 +238,7 @@ export default function App(){
         const json = await resp.json();
         if (!Array.isArray(json)) return;
 
-        const mapped: Patient[] = json.map((p: any) => {
-          const devices: Device[] = (p.devices ?? []).map((d: any) => {
-            const rawReadings = d.readings ?? [];
-            const readings: Reading[] = rawReadings.map((r: any) => {
-              if (r == null) return { time: new Date().toLocaleTimeString(), value: 0 };
-              if (typeof r === "number") return { time: new Date().toLocaleTimeString(), value: r };
-              if (typeof r === "object") {
-                const value = typeof r.value === "number" ? r.value : Number(r.value ?? r) || 0;
-                let timeStr = new Date().toLocaleTimeString();
-                if (r.time) {
-                  if (typeof r.time === "number") timeStr = new Date(r.time * 1000).toLocaleTimeString();
-                  else timeStr = String(r.time);
-                }
-                return { time: timeStr, value };
-              }
-              return { time: new Date().toLocaleTimeString(), value: Number(r) || 0 };
-            });
-
-            // infer latest value
-            const latestReading = rawReadings.length ? rawReadings[rawReadings.length - 1] : null;
-            const latestValue = latestReading ? (typeof latestReading === "object" ? Number(latestReading.value ?? 0) : Number(latestReading)) : 0;
-
-            let inferredTemp: number | undefined = undefined;
-            let inferredHR: number | undefined = undefined;
-            const name = String(d.name ?? "").toLowerCase();
-            if (name.includes("temp")) inferredTemp = latestValue;
-            if (name.includes("heart")) inferredHR = latestValue;
-
-            return {
-              id: d.id,
-              name: d.name,
-              battery: typeof d.battery === "number" ? d.battery : 0,
-              alertLevel: d.alertLevel ?? "green",
-              temperature: typeof d.temperature === "number" ? d.temperature : inferredTemp,
-              heartRate: typeof d.heartRate === "number" ? d.heartRate : inferredHR,
-              readings: readings.slice(-MAX_POINTS),
-            } as Device;
-          });
-
-          return {
-            id: p.id,
-            name: p.name,
-            devices,
-          } as Patient;
-        });
+        const mapped = mapPatients(json);
 
         setPatients(mapped);
         setLastUpdated(new Date().toLocaleTimeString());
@@ -284,51 +261,39 @@ export default function App(){
   }, []); // run only once on mount
 
 
-  // stable interval for summaries (reads patientsRef.current)
+  // poll server-side summaries; unchanged responses come back as empty 304s.
+  // A summary's lastUpdated is when its text last changed, not when it was last checked.
   useEffect(() => {
-    const generate = () => {
-      const current = patientsRef.current;
-      const newSummaries: Record<number, string> = {};
-
-      for (const p of current) {
-        const temps = p.devices.filter((d) => typeof d.temperature === "number").map((d) => d.temperature as number);
-        const hrs = p.devices.filter((d) => typeof d.heartRate === "number").map((d) => d.heartRate as number);
-        const avgTemp = temps.length ? temps.reduce((a, b) => a + b, 0) / temps.length : 0;
-        const avgHR = hrs.length ? hrs.reduce((a, b) => a + b, 0) / hrs.length : 0;
+    let etag: string | null = null;
 
-        let summary = `${p.name}: Vitals stable.`;
-        if (avgTemp > 99) summary = `${p.name}: Temperature slightly elevated.`;
-        if (avgHR > 100) summary = `${p.name}: Elevated heart rate detected.`;
-
-        newSummaries[p.id] = summary;
-      }
-
-      // compare with previous and trigger highlight if changed
-      setHealthSummaries((prev) => {
-        const updated: typeof prev = { ...prev };
-        for (const p of current) {
-          const temps = p.devices.filter(d => typeof d.temperature === "number").map(d => d.temperature!);
-          const hrs = p.devices.filter(d => typeof d.heartRate === "number").map(d => d.heartRate!);
-          const avgTemp = temps.length ? temps.reduce((a, b) => a + b, 0) / temps.length : 0;
-          const avgHR = hrs.length ? hrs.reduce((a, b) => a + b, 0) / hrs.length : 0;
-
-          let summary = `${p.name}: Vitals stable.`;
-          if (avgTemp > 99) summary = `${p.name}: Temperature slightly elevated.`;
-          if (avgHR > 100) summary = `${p.name}: Elevated heart rate detected.`;
-
-          if (!prev[p.id] || prev[p.id].summary !== summary) {
-            setSummaryHighlights((h) => ({ ...h, [p.id]: true }));
-            setTimeout(() => setSummaryHighlights((h) => ({ ...h, [p.id]: false })), 3000);
+    const poll = async () => {
+      try {
+        const resp = await fetch(`${backendHost}/api/summaries`, {
+          headers: etag ? { "If-None-Match": etag } : {},
+        });
+        if (resp.status === 304 || !resp.ok) return;
+        etag = resp.headers.get("ETag");
+        const list: { patientId: number; summary: string; lastUpdated: number }[] = await resp.json();
+
+        // compare with previous and trigger highlight if changed
+        setHealthSummaries((prev) => {
+          const updated: typeof prev = { ...prev };
+          for (const s of list) {
+            if (!prev[s.patientId] || prev[s.patientId].summary !== s.summary) {
+              setSummaryHighlights((h) => ({ ...h, [s.patientId]: true }));
+              setTimeout(() => setSummaryHighlights((h) => ({ ...h, [s.patientId]: false })), 3000);
+            }
+            updated[s.patientId] = { summary: s.summary, lastUpdated: s.lastUpdated };
           }
-
-          updated[p.id] = { summary, lastUpdated: Date.now() };
-        }
-        return updated;
-      });
+          return updated;
+        });
+      } catch (e) {
+        console.error("Failed to fetch summaries", e);
+      }
     };
 
-    generate();
-    const interval = setInterval(generate, 30_000); // every 30s
+    poll();
+    const interval = setInterval(poll, 10_000);
     return () => clearInterval(interval);
   }, []);
 
@@ -519,7 +484,7 @@ export default function App(){
                 <div style={{ fontWeight: 700, marginBottom: 8 }}>{p.name}</div>
                 <div style={{ fontSize: 14, color: "#374151" }}>{summaryData.summary}</div>
                 <div style={{ marginTop: 8, fontSize: 12, color: "#6b7280" }}>
-                  Last summary: {summaryData.lastUpdated ? new Date(summaryData.lastUpdated).toLocaleTimeString() : "N/A"}
+                  Last changed: {summaryData.lastUpdated ? new Date(summaryData.lastUpdated).toLocaleTimeString() : "N/A"}
                 </div>
               </div>
             );